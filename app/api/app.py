@@ -3,19 +3,34 @@ Main module to run Flask API
 """
 # pylint: disable=import-error
 import os
+import math
+import json
+import queue
+import select
+import socket
+import threading
+from contextlib import ExitStack
 from uuid import uuid4
-from flask import request
+from flask import request, Response
 from flask_api import FlaskAPI, status
 from werkzeug.utils import secure_filename
 # pylint: enable=import-error
 
+# own dependencies
+from app.services.concurrency.ordered_service import OrderedService
+from app.services.ocv.page_service import PageService
+from app.services.recognizer.recognizer_service import ImageDecodeError, RecognizerService
+from app.services.scheduler.scheduler_service import QuotaExceededError
+from app.services.scheduler.deadline_service import DeadlineService, DeadlineExceededError
+
 
 app = FlaskAPI(__name__)
 
 
-def allowed_file(filename):
+def allowed_file(filename, extensions=None):
     """Determines if the filetype is allowed or not accordingly to its name"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    extensions = extensions or app.config['ALLOWED_EXTENSIONS']
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
 
 
 def save_file(file) -> str:
@@ -31,15 +46,152 @@ def save_file(file) -> str:
 
 def app_service(name):
     """Method to compact call from other functions and return the corresponding association"""
-    if name not in app.config['SERVICES'].keys():
-        raise KeyError('Invalid service name.')
-    return app.config['SERVICES'][name]
+    return app.config['RECOGNIZER'].service(name)
+
+
+def build_response(result, threshold, handle=None):
+    """Builds the response of the service result, with the handle to parse again what was read"""
+    if result is None:
+        # image cannot be analyzed
+        return (
+            {'error': 'Image is not clear enough with threshold {} or format is unsupported.'.format(threshold),
+             'handle': handle},
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+    return ({'data': result, 'handle': handle}, status.HTTP_200_OK)
+
 
 # we disable redefinition of outer name as pylint thinks `request` is
 # being redefined but it is really not happening
 # pylint: disable=redefined-outer-name
 
 
+def extract_client(request):
+    """Extracts the client of the request (its API key or its address) and whether it is interactive"""
+    client = request.headers.get('X-API-Key') or request.remote_addr
+    interactive = request.headers.get('X-Priority', 'interactive').lower() != 'batch'
+    return client, interactive
+
+
+def client_disconnected(request):
+    """Function that tells whether the client of the request has closed its connection,
+    None if the server does not expose the socket of the request"""
+    connection = request.environ.get('werkzeug.socket')
+    if connection is None:
+        return None
+
+    def disconnected():
+        try:
+            readable, _, _ = select.select([connection], [], [], 0)
+            # the body was already read, so a readable socket without data is a closed one
+            return bool(readable) and not connection.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            return True
+    return disconnected
+
+
+def extract_deadline(request, closed=None):
+    """Builds the deadline of the request from its `X-Timeout` header (seconds, at most the configured timeout)
+    or the configured timeout, cancelled too when the client disconnects or, if given, when the `closed` event is set"""
+    default = app.config['REQUEST_TIMEOUT']
+    try:
+        timeout = float(request.headers.get('X-Timeout', ''))
+    except ValueError:
+        timeout = default
+    # only a positive and finite timeout is one (`inf` overflows the waits and `nan` never expires),
+    # and it cannot be longer than the configured one
+    if not math.isfinite(timeout) or timeout <= 0:
+        timeout = default
+    elif default:
+        timeout = min(timeout, default)
+
+    disconnected = client_disconnected(request)
+    if closed is None:
+        return DeadlineService(timeout=timeout, cancelled=disconnected)
+
+    def cancelled():
+        return closed.is_set() or (disconnected is not None and disconnected())
+    return DeadlineService(timeout=timeout, cancelled=cancelled)
+
+
+def wants_stream(request) -> bool:
+    """Whether the client asked for the server-sent events of the progress instead of the final result"""
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def server_sent_event(event: str, data: dict) -> str:
+    """Formats a server-sent event with its JSON data"""
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+def stream_image(request, service_name: str, threshold=0.75):
+    """Starts processing the uploaded image in the background and streams its progress as server-sent
+    events: `accepted`, `binarized` (only if the whole image is read), `read` (with its `source`, the
+    template or the OCR of the whole image), a `field` event for each field as soon as it is associated
+    and validated (and again if a retry changes it) and, finally, `result` with the same payload as the
+    JSON response, or `error` with its `status`
+
+    Args:
+        request (flask): flask request
+        service_name (str): name of the requested service as indicated by settings
+        threshold (int/float): threshold to tolerate the sesarched terms
+
+    Returns:
+        tuple: generator of the events and the function to call once the response is closed (which cancels
+               the processing), (None, None) if the file type is not allowed
+    """
+    file = request.files['file']
+    if not allowed_file(file.filename):
+        return None, None
+
+    app_service(service_name)
+    scheduler = app.config['SCHEDULER']
+    client, interactive = extract_client(request)
+    closed = threading.Event()
+    deadline = extract_deadline(request, closed=closed)
+
+    # the quota is held until the processing ends, or released at once if the upload cannot be read
+    with ExitStack() as stack:
+        stack.enter_context(scheduler.admit(client))
+        content = file.read()
+        stack = stack.pop_all()
+    events = queue.Queue()
+
+    def progress(event, data=None):
+        events.put((event, data or {}))
+
+    def work():
+        try:
+            with scheduler.slot(service_name, interactive=interactive, deadline=deadline):
+                result, read = app.config['RECOGNIZER'].recognize(content, service_name, threshold=threshold,
+                                                                  deadline=deadline, progress=progress)
+            body, code = build_response(result, threshold, handle=app.config['TEXT_CACHE'].store(read))
+            progress('result' if code == status.HTTP_200_OK else 'error', dict(body, status=code))
+        except DeadlineExceededError as error:
+            scheduler.record_timeout(service_name)
+            progress('error', {'error': str(error), 'status': status.HTTP_504_GATEWAY_TIMEOUT})
+        except ImageDecodeError as error:
+            progress('error', {'error': str(error), 'status': status.HTTP_415_UNSUPPORTED_MEDIA_TYPE})
+        except Exception as error:  # pylint: disable=broad-except
+            # the stream must always end, even if the processing fails unexpectedly
+            progress('error', {'error': str(error), 'status': status.HTTP_500_INTERNAL_SERVER_ERROR})
+        finally:
+            stack.close()
+            events.put(None)
+
+    def stream():
+        try:
+            yield server_sent_event('accepted', {})
+            for event, data in iter(events.get, None):
+                yield server_sent_event(event, data)
+        finally:
+            # the client may have cancelled it, so the processing stops at its next check
+            closed.set()
+
+    threading.Thread(target=work, daemon=True).start()
+    return stream(), closed.set
+
+
 def process_image(request, service_name: str, threshold=0.75):
     """Processes the uploaded image and returns the service result
 
@@ -49,29 +201,123 @@ def process_image(request, service_name: str, threshold=0.75):
         threshold (int/float): threshold to tolerate the sesarched terms
 
     Returns:
-        dict/None: aaccording to processs
+        tuple: service result (dict/None aaccording to processs) and the handle of what was read (str/None)
     """
     file = request.files['file']
-    if allowed_file(file.filename):
+    if not allowed_file(file.filename):
+        return None, None
+
+    # validates the service before processing anything
+    recognizer = app.config['RECOGNIZER']
+    recognizer.service(service_name)
+
+    # the same image retried while it is still being processed waits for the first one instead
+    # of being processed twice, the image is decoded from memory without being written
+    content = file.read()
+    single_flight = app.config['SINGLE_FLIGHT']
+    key = single_flight.key(content, service_name, threshold)
+
+    # only the request actually processing the image waits for a slot of the scheduler
+    scheduler = app.config['SCHEDULER']
+    client, interactive = extract_client(request)
+    deadline = extract_deadline(request)
+
+    def scheduled_read():
+        # the stages of the slow requests are timed and their image kept, if capturing is enabled, also
+        # of the ones that timed out or failed (which end with the `error` stage)
+        capture = app.config['CAPTURE']
+        timer, error = capture.timer() if capture is not None else None, None
+        try:
+            with scheduler.slot(service_name, interactive=interactive, deadline=deadline):
+                if timer is not None:
+                    timer.mark('scheduled')
+                return recognizer.recognize(content, service_name, threshold=threshold, deadline=deadline,
+                                            progress=timer.progress if timer is not None else None)
+        except Exception as exception:
+            error = exception
+            raise
+        finally:
+            if timer is not None:
+                timer.mark('parsed' if error is None else 'error')
+                capture.record(content, service_name, threshold, timer, error=error)
+
+    with scheduler.admit(client):
+        result, read = single_flight.do(key, scheduled_read, deadline=deadline)
+
+    # what was read is kept so it can be parsed again without processing the image
+    return result, app.config['TEXT_CACHE'].store(read)
+
+
+def process_pages(request, service_name: str, threshold=0.75):
+    """Starts processing the pages of the uploaded document (PDF, TIFF or image), decoding and reading
+    them concurrently one at a time
+
+    Args:
+        request (flask): flask request, with `stop=found` to stop at the first page the service recognizes
+        service_name (str): name of the requested service as indicated by settings
+        threshold (int/float): threshold to tolerate the sesarched terms
+
+    Returns:
+        tuple: generator of the JSON line of each page and the function to call once the response is closed,
+               (None, None) if the file type is not allowed
+    """
+    file = request.files['file']
+    if not allowed_file(file.filename, app.config['ALLOWED_EXTENSIONS'] | app.config['PAGED_EXTENSIONS']):
+        return None, None
+
+    recognizer = app.config['RECOGNIZER']
+    recognizer.service(service_name)
+    stop = request.data['stop'] == 'found' if 'stop' in request.data.keys() else False
+    scheduler = app.config['SCHEDULER']
+    client, interactive = extract_client(request)
+    deadline = extract_deadline(request)
+
+    # the quota is held and the written document is kept while the response is being streamed,
+    # until either the pages end or the response is closed (or at once if the document cannot be written)
+    with ExitStack() as stack:
+        stack.enter_context(scheduler.admit(client))
         file_path = save_file(file)
+        stack.callback(os.remove, file_path)
+        stack = stack.pop_all()
+
+    def read_page(img):
+        with scheduler.slot(service_name, interactive=interactive, deadline=deadline):
+            return recognizer.recognize(img, service_name, threshold=threshold, deadline=deadline)
 
-        # concatenates result, passing directly what is read to the processing
-        service = app_service(service_name)
-        result = service.process_text(app.config['OCV'].process(file_path), threshold=threshold)
+    def lines():
+        pages = OrderedService.process(PageService.pages(file_path, file.filename.rsplit('.', 1)[1]), read_page,
+                                       workers=app.config['PAGE_WORKERS'])
+        try:
+            for number, (result, read) in enumerate(pages, 1):
+                body, code = build_response(result, threshold, handle=app.config['TEXT_CACHE'].store(read))
+                yield json.dumps(dict(body, page=number, status=code)) + '\n'
+                if stop and result is not None:
+                    break
+        except DeadlineExceededError as error:
+            scheduler.record_timeout(service_name)
+            yield json.dumps({'error': str(error), 'status': status.HTTP_504_GATEWAY_TIMEOUT}) + '\n'
+        except ImageDecodeError as error:
+            yield json.dumps({'error': str(error), 'status': status.HTTP_415_UNSUPPORTED_MEDIA_TYPE}) + '\n'
+        except Exception as error:  # pylint: disable=broad-except
+            # the status was already sent, so an unexpected failure can only be told by the last line
+            yield json.dumps({'error': str(error), 'status': status.HTTP_500_INTERNAL_SERVER_ERROR}) + '\n'
+        finally:
+            # the pages not started yet are cancelled
+            pages.close()
+            stack.close()
 
-        # clean written image
-        os.remove(file_path)
-    else:
-        result = None
-    return result
+    return lines(), stack.close
 
 
 def extract_threshold(request):
     """Simplifies the extraction from request and handles errors"""
     threshold = request.data['threshold'] if 'threshold' in request.data.keys() else None
-    if threshold and threshold.isnumeric():
-        return min(1.0, max(0.1, float(threshold)))
-    return 0.75
+    try:
+        threshold = float(threshold)
+    except (TypeError, ValueError):
+        return 0.75
+    # nan is not a threshold, it would be clamped to the minimum
+    return min(1.0, max(0.1, threshold)) if not math.isnan(threshold) else 0.75
 # pylint: enable=redefined-outer-name
 
 
@@ -85,15 +331,85 @@ def analyze_image(service):
     try:
         # we extract (if existing) the threshold and apply a 'roof' to cap it at 1
         threshold = extract_threshold(request)
-        result = process_image(request, service, threshold=threshold)
-        # image cannot be analyzed
-        if result is None:
-            result = (
-                {'error': 'Image is not clear enough with threshold {} or format is unsupported.'.format(threshold)},
-                status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
-            )
+        if wants_stream(request):
+            events, close = stream_image(request, service, threshold=threshold)
+            if events is None:
+                result = build_response(None, threshold)
+            else:
+                result = Response(events, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+                result.call_on_close(close)
+        else:
+            result, handle = process_image(request, service, threshold=threshold)
+            result = build_response(result, threshold, handle=handle)
+    except KeyError as error:
+        result = ({'error': str(error)}, status.HTTP_400_BAD_REQUEST)
+    except QuotaExceededError as error:
+        result = ({'error': str(error)}, status.HTTP_429_TOO_MANY_REQUESTS)
+    except DeadlineExceededError as error:
+        app.config['SCHEDULER'].record_timeout(service)
+        result = ({'error': str(error)}, status.HTTP_504_GATEWAY_TIMEOUT)
+    except ImageDecodeError as error:
+        # the content of the file is not an image
+        result = ({'error': str(error)}, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    finally:
+        if wants_stream(request) and isinstance(result, tuple):
+            # the client only accepts events, so the failure is an event too
+            body, code = result
+            result = Response(server_sent_event('error', dict(body, status=code)), status=code,
+                              mimetype='text/event-stream')
+        # disabling of lost exception as it is being handled
+        return result  # pylint: disable=lost-exception
+
+
+@app.route('/api/<string:service>/pages', methods=['POST'])
+def analyze_pages(service):
+    """
+    API endpoint that streams the result of each page of a multi-page document (PDF/TIFF),
+    one JSON line per page in order
+    """
+    service = service.lower()
+    try:
+        threshold = extract_threshold(request)
+        lines, close = process_pages(request, service, threshold=threshold)
+        if lines is None:
+            result = build_response(None, threshold)
+        else:
+            result = Response(lines, mimetype='application/x-ndjson')
+            result.call_on_close(close)
+    except KeyError as error:
+        result = ({'error': str(error)}, status.HTTP_400_BAD_REQUEST)
+    except QuotaExceededError as error:
+        result = ({'error': str(error)}, status.HTTP_429_TOO_MANY_REQUESTS)
+    finally:
+        # disabling of lost exception as it is being handled
+        return result  # pylint: disable=lost-exception
+
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """
+    API endpoint with the wait times and timeouts of each service in the scheduler
+    """
+    return ({'scheduler': app.config['SCHEDULER'].stats()}, status.HTTP_200_OK)
+
+
+@app.route('/api/<string:service>/reparse', methods=['POST'])
+def reparse_text(service):
+    """
+    API endpoint to parse again, with another threshold or service, what was read from an image
+    in a previous request (identified by its `handle`) without processing the image again.
+    The fields read from a template are not searched by their key words, so their parsing ignores the threshold
+    """
+    service = service.lower()
+    try:
+        threshold = extract_threshold(request)
+        handle = request.data['handle'] if 'handle' in request.data.keys() else None
+        read = app.config['TEXT_CACHE'].get(handle)
+        if read is None:
+            result = ({'error': 'Handle does not exist or it has expired.'}, status.HTTP_404_NOT_FOUND)
         else:
-            result = ({'data': result}, status.HTTP_200_OK)
+            result = RecognizerService.parse(app_service(service), read, threshold=threshold)
+            result = build_response(result, threshold, handle=handle)
     except KeyError as error:
         result = ({'error': str(error)}, status.HTTP_400_BAD_REQUEST)
     finally:
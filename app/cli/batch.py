@@ -0,0 +1,121 @@
+"""
+Offline batch processing of a directory (or manifest) of images into JSONL results
+
+Usage:
+    python -m app.cli.batch <directory or manifest> --service cni --output results.jsonl
+
+The files already in the checkpoint (by default `<output>.checkpoint`) are skipped, so an interrupted
+run is resumed by executing the same command again.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from multiprocessing import Pool
+
+# own dependencies
+from app.settings.settings import config
+from app.services.recognizer.recognizer_service import RecognizerService
+
+
+# parameters of the pool worker processes (see `init_worker`)
+WORKER = {}
+
+
+def list_files(source: str, extensions: set) -> list:
+    """Lists the images of a directory (recursively) or of a manifest with one path per line"""
+    if os.path.isdir(source):
+        files = [os.path.join(root, name) for root, _, names in os.walk(source) for name in names]
+    else:
+        with open(source, encoding='utf-8') as manifest:
+            files = [line.strip() for line in manifest if line.strip()]
+    return sorted(name for name in files if name.rsplit('.', 1)[-1].lower() in extensions)
+
+
+def read_checkpoint(checkpoint: str) -> set:
+    """Files already processed by a previous run"""
+    if not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint, encoding='utf-8') as done:
+        return {line.rstrip('\n') for line in done if line.strip()}
+
+
+def init_worker(service_name: str, threshold: float, params: dict):
+    """Initializes the parameters and the recognizer (with the given binarization parameters) of each worker process"""
+    recognizer = RecognizerService(config['SERVICES'], templates=config['TEMPLATES'], profiles={service_name: params},
+                                   crop=config['RECOGNIZER'].crop, strip_height=config['RECOGNIZER'].strip_height)
+    WORKER.update({'service_name': service_name, 'threshold': threshold, 'recognizer': recognizer})
+
+
+def process_file(file_name: str) -> dict:
+    """Processes a single image in a worker process. Returns dict with the result or the error"""
+    start = time.perf_counter()
+    record = {'file': file_name}
+    try:
+        with open(file_name, 'rb') as file:
+            record['data'] = WORKER['recognizer'].process(file, WORKER['service_name'], threshold=WORKER['threshold'])
+    except Exception as error:  # pylint: disable=broad-except
+        # a broken file must not stop the whole batch
+        record['error'] = f'{type(error).__name__}: {error}'
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def report(done: int, total: int, start: float, stream=sys.stderr):
+    """Writes the progress and throughput of the batch"""
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed else 0.
+    eta = (total - done) / rate if rate else float('inf')
+    stream.write(f'\r{done}/{total} files, {rate:.2f} files/s, ETA {eta:.0f} s')
+    stream.flush()
+
+
+def run(args) -> int:
+    """Processes the pending files of the batch. Returns the number of processed files"""
+    files = list_files(args.source, config['ALLOWED_EXTENSIONS'])
+    checkpoint = args.checkpoint or args.output + '.checkpoint'
+    done = read_checkpoint(checkpoint)
+    pending = [name for name in files if name not in done]
+    sys.stderr.write(f'{len(files)} files, {len(files) - len(pending)} already processed\n')
+
+    # the parameters given override the tuned profile of the service
+    params = dict(config['PROFILES'].get(args.service, {}))
+    params.update({key: value for key, value in (('gamma', args.gamma), ('block_size', args.block_size),
+                                                  ('delta', args.delta)) if value is not None})
+    start, processed = time.perf_counter(), 0
+    with open(args.output, 'a', encoding='utf-8') as output, open(checkpoint, 'a', encoding='utf-8') as check, \
+            Pool(args.processes, initializer=init_worker, initargs=(args.service, args.threshold, params),
+                 maxtasksperchild=args.max_tasks) as pool:
+        for record in pool.imap_unordered(process_file, pending):
+            # the result is written before checkpointing it, so a crash can only repeat a file, never lose it
+            output.write(json.dumps(record) + '\n')
+            output.flush()
+            check.write(record['file'] + '\n')
+            check.flush()
+            processed += 1
+            if processed % args.report_every == 0 or processed == len(pending):
+                report(processed, len(pending), start)
+    sys.stderr.write('\n')
+    return processed
+
+
+def parse_args(argv=None):
+    """Command line arguments of the batch"""
+    parser = argparse.ArgumentParser(description='Processes a directory or manifest of images into JSONL.')
+    parser.add_argument('source', help='directory of images or manifest file with one image path per line')
+    parser.add_argument('--service', default='cni', choices=sorted(config['SERVICES']))
+    parser.add_argument('--output', default='results.jsonl', help='JSONL file where results are appended')
+    parser.add_argument('--checkpoint', help='file of processed images (default: <output>.checkpoint)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--max-tasks', type=int, default=None, help='files per worker before it is replaced')
+    parser.add_argument('--threshold', type=float, default=0.75)
+    parser.add_argument('--gamma', type=float, help='default: the profile of the service or 1')
+    parser.add_argument('--block-size', type=int, help='default: the profile of the service or 80')
+    parser.add_argument('--delta', type=float, help='default: the profile of the service or 50')
+    parser.add_argument('--report-every', type=int, default=10, help='files between progress reports')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    run(parse_args())
@@ -0,0 +1,91 @@
+"""
+Offline replay of the captured slow requests through the current pipeline
+
+Usage:
+    python -m app.cli.replay <capture directory> --output replay.jsonl
+
+Each capture (see `CAPTURE_DIR`) is recognized again with the current code and settings, keeping the fastest
+of `--repeat` runs, and its stage timings are compared with the captured ones, so that the outliers of
+production become regression benchmarks. The time waiting for a slot (`scheduled`) is not replayed.
+"""
+import sys
+import json
+import argparse
+
+# own dependencies
+from app.settings.settings import config, CAPTURE_KEY
+from app.services.capture.capture_service import CaptureService, StageTimer
+
+
+def replay(capture: dict, repeat=1) -> StageTimer:
+    """Recognizes the image of the capture again with its service and threshold. Returns the timer of the fastest run"""
+    best = None
+    for _ in range(max(1, repeat)):
+        timer = StageTimer()
+        config['RECOGNIZER'].recognize(capture['image'], capture['service'], threshold=capture['threshold'],
+                                       progress=timer.progress)
+        timer.mark('parsed')
+        if best is None or timer.total() < best.total():
+            best = timer
+    return best
+
+
+def ratio(replayed: float, captured: float):
+    """Replayed seconds relative to the captured ones (below 1 is faster), None if nothing was captured"""
+    return round(replayed / captured, 3) if captured else None
+
+
+def compare(capture: dict, timer: StageTimer) -> dict:
+    """Compares the captured timings with the replayed ones, the total without the captured wait for a slot
+
+    Returns:
+        dict: i.e.: {'captured': 3.1, 'replayed': 1.2, 'ratio': 0.387,
+                     'stages': {'binarized': {'captured': 2.5, 'replayed': 0.8, 'ratio': 0.32}, ...}}
+    """
+    stages = {}
+    for stage in sorted(set(capture['stages']) | set(timer.stages)):
+        captured, replayed = capture['stages'].get(stage), timer.stages.get(stage)
+        stages[stage] = {
+            'captured': round(captured, 4) if captured is not None else None,
+            'replayed': round(replayed, 4) if replayed is not None else None,
+            'ratio': ratio(replayed, captured) if None not in (captured, replayed) else None
+        }
+    captured = capture['total'] - capture['stages'].get('scheduled', 0.)
+    return {'captured': round(captured, 4), 'replayed': round(timer.total(), 4),
+            'ratio': ratio(timer.total(), captured), 'stages': stages}
+
+
+def run(args) -> list:
+    """Replays all the captures of the directory. Returns the comparison of each one"""
+    captures = CaptureService(args.source, key=args.key)
+    records = []
+    with open(args.output, 'w', encoding='utf-8') as output:
+        for path in captures.entries():
+            record = {'capture': path}
+            try:
+                capture = captures.load(path)
+                record.update(service=capture['service'], **compare(capture, replay(capture, repeat=args.repeat)))
+                if 'error' in capture:
+                    # the captured request timed out or failed, its last stage is `error`
+                    record['captured_error'] = capture['error']
+            except Exception as error:  # pylint: disable=broad-except
+                # a capture that cannot be replayed must not stop the others
+                record['error'] = f'{type(error).__name__}: {error}'
+            output.write(json.dumps(record) + '\n')
+            records.append(record)
+            sys.stderr.write(f"{path}: {record.get('captured')} s captured, {record.get('replayed')} s replayed\n")
+    return records
+
+
+def parse_args(argv=None):
+    """Command line arguments of the replay"""
+    parser = argparse.ArgumentParser(description='Replays the captured slow requests and compares their timings.')
+    parser.add_argument('source', help='directory of the captures (CAPTURE_DIR)')
+    parser.add_argument('--output', default='replay.jsonl', help='JSONL file of the comparison of each capture')
+    parser.add_argument('--key', default=CAPTURE_KEY, help='Fernet key of the captures (default: CAPTURE_KEY)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each capture, the fastest one is kept')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    run(parse_args())
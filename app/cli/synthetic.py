@@ -0,0 +1,239 @@
+"""
+Synthetic CNI-like images with ground truth, to build benchmark and load corpora of any size
+without sharing real identity documents
+
+Usage:
+    python -m app.cli.synthetic <output directory> --count 1000 --seed 0
+
+Each image `cni_<index>.jpg` is written with `cni_<index>.json`, which holds what `CNIService.process_text`
+is expected to return for it. The same seed and index always generate the same image.
+"""
+# pylint: disable=no-member
+import os
+import json
+import argparse
+import cv2
+import numpy as np
+
+# own dependencies
+from app.services.documents.cni_service import CNIService
+
+
+# months as printed in the CNI ('SEP' instead of 'SEPT' so dates match `CNIService.PATTERNS`)
+MONTHS = ['ENE', 'FEB', 'MAR', 'ABR', 'MAY', 'JUN', 'JUL', 'AGO', 'SEP', 'OCT', 'NOV', 'DIC']
+
+FIRST_NAMES = ['JUAN', 'MARIA', 'JOSE', 'CAROLINA', 'PEDRO', 'CAMILA', 'DIEGO', 'VALENTINA', 'LUIS', 'FERNANDA',
+               'CLAUDIO', 'OLGA', 'RONY', 'MARCELA', 'ANTONIO', 'TERESA', 'DANIEL', 'ESTER', 'JAVIERA', 'MATIAS']
+LAST_NAMES = ['GONZALEZ', 'MUNOZ', 'ROJAS', 'DIAZ', 'PEREZ', 'SOTO', 'CONTRERAS', 'SILVA', 'MARTINEZ', 'SEPULVEDA',
+              'MORALES', 'RODRIGUEZ', 'LOPEZ', 'FUENTES', 'HERNANDEZ', 'TORRES', 'ARAYA', 'FLORES', 'ESPINOZA', 'VIDAL']
+NATIONALITIES = ['CHILENA', 'CHILENA', 'CHILENA', 'PERUANA', 'VENEZOLANA', 'ARGENTINA', 'COLOMBIANA']
+
+# canonical size of the card (ID-1 proportions)
+WIDTH, HEIGHT = 1100, 700
+
+# relative position of the second column of values (i.e.: 'SEXO')
+RIGHT_COLUMN = 0.6
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+INK = (40, 40, 40)
+LABEL_INK = (150, 80, 20)
+
+
+def run_check_digit(number: int) -> str:
+    """Check digit (modulo 11) of a RUN number"""
+    total, factor = 0, 2
+    for digit in reversed(str(number)):
+        total += int(digit) * factor
+        factor = 2 if factor == 7 else factor + 1
+    digit = 11 - total % 11
+    return {11: '0', 10: 'K'}.get(digit, str(digit))
+
+
+def _dotted(number: int) -> str:
+    """Thousands separated by dots (i.e.: 5.632.605)"""
+    return f'{number:,}'.replace(',', '.')
+
+
+def _date(rng, first_year: int, last_year: int) -> tuple:
+    """Random date as (day, month, year)"""
+    return int(rng.integers(1, 29)), int(rng.integers(0, 12)), int(rng.integers(first_year, last_year + 1))
+
+
+def _format_date(date: tuple) -> str:
+    day, month, year = date
+    return f'{day:02d} {MONTHS[month]} {year}'
+
+
+def random_identity(rng) -> dict:
+    """Random but valid CNI values, keyed as returned by `CNIService.process_text`"""
+    number = int(rng.integers(1000000, 26000000))
+    emission = _date(rng, 2010, 2023)
+    due = (emission[0], emission[1], emission[2] + int(rng.integers(5, 11)))
+    return {
+        'run': f'{_dotted(number)}-{run_check_digit(number)}',
+        'apellidos': ' '.join(rng.choice(LAST_NAMES, 2, replace=False)),
+        'nombres': ' '.join(rng.choice(FIRST_NAMES, int(rng.integers(1, 3)), replace=False)),
+        'nacionalidad': str(rng.choice(NATIONALITIES)),
+        'sexo': str(rng.choice(['M', 'F'])),
+        'fecha_de_nacimiento': _format_date(_date(rng, 1940, 2005)),
+        'numero_documento': _dotted(int(rng.integers(100000000, 600000000))),
+        'fecha_de_emision': _format_date(emission),
+        'fecha_de_vencimiento': _format_date(due)
+    }
+
+
+def _text(img, text, box, scale, color=INK, thickness=2):  # pylint: disable=too-many-arguments
+    """Writes the text at the bottom left of a relative box (x0, y0, x1, y1)"""
+    cv2.putText(img, text, (int(box[0] * WIDTH) + 8, int(box[3] * HEIGHT) - 10), FONT, scale, color, thickness,
+                cv2.LINE_AA)
+
+
+def _labels(img):
+    """Writes the labels of the fields above their boxes"""
+    fields = CNIService.TEMPLATE_FIELDS
+    labels = [
+        ('APELLIDOS', fields['APELLIDOS'][0], fields['APELLIDOS'][1]),
+        ('NOMBRES', fields['NOMBRES'][0], fields['NOMBRES'][1]),
+        ('NACIONALIDAD', fields['NACIONALIDAD SEXO'][0], fields['NACIONALIDAD SEXO'][1]),
+        ('SEXO', RIGHT_COLUMN, fields['NACIONALIDAD SEXO'][1]),
+        ('FECHA DE NACIMIENTO', fields['FECHA DE NACIMIENTO NUMERO DOCUMENTO'][0],
+         fields['FECHA DE NACIMIENTO NUMERO DOCUMENTO'][1]),
+        ('NUMERO DOCUMENTO', RIGHT_COLUMN, fields['FECHA DE NACIMIENTO NUMERO DOCUMENTO'][1]),
+        ('FECHA DE EMISION', fields['FECHA DE EMISION FECHA DE VENCIMIENTO'][0],
+         fields['FECHA DE EMISION FECHA DE VENCIMIENTO'][1]),
+        ('FECHA DE VENCIMIENTO', RIGHT_COLUMN, fields['FECHA DE EMISION FECHA DE VENCIMIENTO'][1]),
+        ('FIRMA DEL TITULAR', 0.34, 0.75)
+    ]
+    for label, __x, __y in labels:
+        cv2.putText(img, label, (int(__x * WIDTH) + 8, int(__y * HEIGHT) - 4), FONT, 0.55, LABEL_INK, 2, cv2.LINE_AA)
+
+
+def render(identity: dict, rng):
+    """Renders a clean CNI-like card with the layout of `CNIService.TEMPLATE_FIELDS`. Returns cv2 image"""
+    background = rng.integers(215, 250, 3)
+    img = np.empty((HEIGHT, WIDTH, 3), np.uint8)
+    img[:] = background
+    # soft background pattern
+    for _ in range(30):
+        center = (int(rng.integers(0, WIDTH)), int(rng.integers(0, HEIGHT)))
+        cv2.circle(img, center, int(rng.integers(20, 200)), tuple(int(c) - 12 for c in background), 1, cv2.LINE_AA)
+
+    # header and photo
+    cv2.putText(img, 'CEDULA DE', (40, 55), FONT, 1.1, LABEL_INK, 2, cv2.LINE_AA)
+    cv2.putText(img, 'IDENTIDAD', (40, 95), FONT, 1.1, LABEL_INK, 2, cv2.LINE_AA)
+    cv2.putText(img, 'REPUBLICA DE CHILE', (380, 60), FONT, 1.4, LABEL_INK, 3, cv2.LINE_AA)
+    cv2.putText(img, 'SERVICIO DE REGISTRO CIVIL E IDENTIFICACION', (380, 95), FONT, 0.6, LABEL_INK, 1, cv2.LINE_AA)
+    cv2.rectangle(img, (40, 150), (340, 560), (170, 170, 170), -1)
+    cv2.ellipse(img, (190, 330), (90, 120), 0, 0, 360, (110, 110, 110), -1)
+
+    _labels(img)
+    fields = CNIService.TEMPLATE_FIELDS
+    last_names = identity['apellidos'].split(' ', 1)
+    box = fields['APELLIDOS']
+    middle = (box[1] + box[3]) / 2
+    _text(img, last_names[0], (box[0], box[1], box[2], middle + 0.01), 1.2)
+    _text(img, last_names[1], (box[0], middle, box[2], box[3]), 1.2)
+    _text(img, identity['nombres'], fields['NOMBRES'], 1.2)
+
+    for field, left, right in (('NACIONALIDAD SEXO', 'nacionalidad', 'sexo'),
+                               ('FECHA DE NACIMIENTO NUMERO DOCUMENTO', 'fecha_de_nacimiento', 'numero_documento'),
+                               ('FECHA DE EMISION FECHA DE VENCIMIENTO', 'fecha_de_emision', 'fecha_de_vencimiento')):
+        box = fields[field]
+        _text(img, identity[left], box, 1.0)
+        _text(img, identity[right], (RIGHT_COLUMN, box[1], box[2], box[3]), 1.0)
+
+    _text(img, f"RUN {identity['run']}", fields['RUN'], 1.2, thickness=3)
+    return img
+
+
+def _perspective(img, rng):
+    """Places the card with random corners over a larger background. Returns cv2 image"""
+    height, width = img.shape[:2]
+    margin = int(rng.uniform(0.05, 0.4) * width)
+    out_size = (width + 2 * margin, height + 2 * margin)
+    corners = np.array([[0, 0], [width, 0], [width, height], [0, height]], np.float32)
+    jitter = rng.uniform(-0.06, 0.06, (4, 2)) * np.array([width, height])
+    target = (corners + margin + jitter).astype(np.float32)
+    homography = cv2.getPerspectiveTransform(corners, target)
+    background = np.empty((out_size[1], out_size[0], 3), np.uint8)
+    background[:] = rng.integers(30, 200, 3)
+    background = cv2.add(background, rng.integers(0, 40, background.shape, dtype=np.uint8))
+    return cv2.warpPerspective(img, homography, out_size, dst=background, borderMode=cv2.BORDER_TRANSPARENT)
+
+
+def _glare(img, rng):
+    """Adds a bright spot with a gaussian falloff. Returns cv2 image"""
+    rows, cols = np.ogrid[:img.shape[0], :img.shape[1]]
+    center_y, center_x = rng.uniform(0, img.shape[0]), rng.uniform(0, img.shape[1])
+    radius_y, radius_x = img.shape[0] * rng.uniform(0.1, 0.3), img.shape[1] * rng.uniform(0.1, 0.3)
+    glare = rng.uniform(60, 160) * np.exp(-((rows - center_y) / radius_y) ** 2 - ((cols - center_x) / radius_x) ** 2)
+    return np.clip(img + glare[..., None], 0, 255).astype(np.uint8)
+
+
+def degrade(img, rng):
+    """Applies realistic photo degradations: resolution, perspective over a background, blur, glare,
+    noise and JPEG artifacts. Returns cv2 image"""
+    img = _perspective(img, rng)
+
+    # resolution
+    scale = rng.uniform(0.4, 1.5)
+    img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+
+    # blur
+    if rng.random() < 0.7:
+        kernel = int(rng.choice([3, 5]))
+        img = cv2.GaussianBlur(img, (kernel, kernel), 0)
+
+    # glare: additive bright spot with a gaussian falloff
+    if rng.random() < 0.5:
+        img = _glare(img, rng)
+
+    # sensor noise
+    noise = rng.normal(0, rng.uniform(2, 12), img.shape)
+    img = np.clip(img + noise, 0, 255).astype(np.uint8)
+
+    # JPEG artifacts
+    _, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, int(rng.integers(30, 90))])
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+
+def generate(index: int, seed=0, clean=False) -> tuple:
+    """Generates the synthetic CNI number `index` of the corpus of `seed`
+
+    Returns:
+        tuple: cv2 image and its ground truth (dict)
+    """
+    rng = np.random.default_rng([seed, index])
+    identity = random_identity(rng)
+    img = render(identity, rng)
+    return (img if clean else degrade(img, rng)), identity
+
+
+def write_corpus(output: str, count: int, seed=0, start=0, clean=False) -> list:
+    """Writes `count` images and their ground truth into `output`. Returns the written image names"""
+    os.makedirs(output, exist_ok=True)
+    names = []
+    for index in range(start, start + count):
+        img, identity = generate(index, seed=seed, clean=clean)
+        name = os.path.join(output, f'cni_{index:06d}')
+        cv2.imwrite(name + '.jpg', img)
+        with open(name + '.json', 'w', encoding='utf-8') as truth:
+            json.dump(identity, truth, ensure_ascii=False, indent=2)
+        names.append(name + '.jpg')
+    return names
+
+
+def parse_args(argv=None):
+    """Command line arguments of the generator"""
+    parser = argparse.ArgumentParser(description='Generates synthetic CNI images with their ground truth.')
+    parser.add_argument('output', help='directory where images and ground truth are written')
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', type=int, default=0, help='index of the first image (to extend a corpus)')
+    parser.add_argument('--clean', action='store_true', help='do not apply degradations')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    ARGS = parse_args()
+    write_corpus(ARGS.output, ARGS.count, seed=ARGS.seed, start=ARGS.start, clean=ARGS.clean)
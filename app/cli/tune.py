@@ -0,0 +1,182 @@
+"""
+Offline tuning of the binarization parameters of a document service against a labeled corpus
+
+Usage:
+    python -m app.cli.tune <corpus> --service cni --output profiles.json
+
+The corpus is a directory of images, each one with its ground truth `<name>.json` as the service returns
+it (see `app.cli.synthetic`). Every combination of the grid is scored by its field level accuracy and its
+latency, and the best one is written as the profile of the service (the API loads it with `OCV_PROFILE`).
+"""
+# pylint: disable=no-member
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+from multiprocessing import Pool
+import cv2
+import numpy as np
+import pytesseract
+
+# own dependencies
+from app.settings.settings import config
+from app.cli.batch import list_files, report
+
+
+# parameters searched, the combination stage is tried on each mask without computing it again
+GRID = {
+    'gamma': [0.7, 1, 1.5],
+    'block_size': [40, 60, 80, 120],
+    'delta': [30, 50, 70],
+    'combine_block_size': [10, 20, 40]
+}
+
+# parameters of the pool worker processes (see `init_worker`)
+WORKER = {}
+
+
+def load_corpus(source: str) -> list:
+    """Lists the images of the corpus that have their ground truth. Returns list of (image, truth)"""
+    corpus = []
+    for name in list_files(source, config['ALLOWED_EXTENSIONS']):
+        truth = name.rsplit('.', 1)[0] + '.json'
+        if os.path.exists(truth):
+            with open(truth, encoding='utf-8') as labels:
+                corpus.append((name, json.load(labels)))
+    return corpus
+
+
+def field_accuracy(result, truth: dict) -> tuple:
+    """Fields of the ground truth that the result got right. Returns tuple (correct, total)"""
+    result = result or {}
+    return sum(result.get(field) == value for field, value in truth.items()), len(truth)
+
+
+def init_worker(service_name: str, threshold: float, cache: str):
+    """Initializes the parameters of each worker process"""
+    WORKER.update({'service_name': service_name, 'threshold': threshold, 'cache': cache})
+
+
+def cached_mask(img_name: str, img, gamma=1, block_size=80, delta=50) -> tuple:
+    """Mask of the first stages of the binarization and the seconds it took to compute it, kept in the
+    cache directory (if any) so that another run with a wider grid does not compute it again"""
+    path = None
+    if WORKER.get('cache'):
+        key = f'{os.path.abspath(img_name)}:{os.path.getmtime(img_name)}:{gamma}:{block_size}:{delta}'
+        path = os.path.join(WORKER['cache'], hashlib.sha1(key.encode()).hexdigest() + '.npz')
+        if os.path.exists(path):
+            with np.load(path) as stored:
+                return stored['mask'], float(stored['seconds'])
+
+    start = time.perf_counter()
+    mask = config['OCV'].adjust_gamma(img, gamma=gamma)
+    mask = config['OCV'].process_image(mask, block_size=block_size, delta=delta)
+    seconds = time.perf_counter() - start
+    if path is not None:
+        np.savez_compressed(path, mask=mask, seconds=seconds)
+    return mask, seconds
+
+
+def evaluate(task: tuple) -> list:
+    """Scores the combinations of a mask of an image. Returns list of (params, correct, total, seconds)"""
+    img_name, truth, params = task
+    service = config['SERVICES'][WORKER['service_name']]
+    img = cv2.imread(img_name)
+    mask, mask_seconds = cached_mask(img_name, img, **params)
+
+    scores = []
+    for combine_block_size in GRID['combine_block_size']:
+        start = time.perf_counter()
+        text = pytesseract.image_to_string(config['OCV'].combine_process(img, mask, block_size=combine_block_size))
+        seconds = mask_seconds + time.perf_counter() - start
+
+        result = service.process_text(text, threshold=WORKER['threshold'])
+        scores.append((dict(params, combine_block_size=combine_block_size), *field_accuracy(result, truth), seconds))
+    return scores
+
+
+def rank(scores: list, latency_weight: float) -> list:
+    """Aggregates the scores of each combination over the corpus, best first. The score is the field
+    accuracy minus `latency_weight` for each second of mean latency
+
+    Returns:
+        list: dicts with the params, accuracy, latency and score of each combination
+    """
+    totals = {}
+    for params, correct, total, seconds in scores:
+        # correct and total fields, seconds and images of each combination
+        entry = totals.setdefault(tuple(sorted(params.items())), [0, 0, 0., 0])
+        entry[0] += correct
+        entry[1] += total
+        entry[2] += seconds
+        entry[3] += 1
+
+    ranking = []
+    for key, (correct, total, seconds, count) in totals.items():
+        accuracy = correct / total if total else 0.
+        latency = seconds / count
+        ranking.append({'params': dict(key), 'accuracy': round(accuracy, 4), 'latency': round(latency, 4),
+                        'score': round(accuracy - latency_weight * latency, 4)})
+    return sorted(ranking, key=lambda item: (-item['score'], item['latency']))
+
+
+def write_profile(output: str, service_name: str, best: dict):
+    """Writes the best combination as the profile of the service, keeping the profiles of the others"""
+    profiles = {}
+    if os.path.exists(output):
+        with open(output, encoding='utf-8') as stored:
+            profiles = json.load(stored)
+    profiles[service_name] = best
+    with open(output, 'w', encoding='utf-8') as stored:
+        json.dump(profiles, stored, indent=2)
+
+
+def run(args) -> list:
+    """Searches the grid over the corpus with all the processes. Returns the ranking"""
+    corpus = load_corpus(args.source)
+    if not corpus:
+        raise ValueError(f'No images with ground truth in {args.source}.')
+    if args.cache:
+        os.makedirs(args.cache, exist_ok=True)
+
+    # a task for each image and mask, the most expensive stages
+    masks = itertools.product(GRID['gamma'], GRID['block_size'], GRID['delta'])
+    tasks = [(name, truth, dict(zip(('gamma', 'block_size', 'delta'), params)))
+             for params in masks for name, truth in corpus]
+    sys.stderr.write(f'{len(corpus)} images, {len(tasks)} masks\n')
+
+    scores, start = [], time.perf_counter()
+    with Pool(args.processes, initializer=init_worker, initargs=(args.service, args.threshold, args.cache)) as pool:
+        for done, task_scores in enumerate(pool.imap_unordered(evaluate, tasks), 1):
+            scores.extend(task_scores)
+            if done % args.report_every == 0 or done == len(tasks):
+                report(done, len(tasks), start)
+    sys.stderr.write('\n')
+
+    ranking = rank(scores, args.latency_weight)
+    for item in ranking[:5]:
+        sys.stderr.write(json.dumps(item) + '\n')
+    write_profile(args.output, args.service, ranking[0])
+    return ranking
+
+
+def parse_args(argv=None):
+    """Command line arguments of the tuner"""
+    parser = argparse.ArgumentParser(description='Tunes the binarization parameters of a service on a corpus.')
+    parser.add_argument('source', help='directory of images with their ground truth JSON')
+    parser.add_argument('--service', default='cni', choices=sorted(config['SERVICES']))
+    parser.add_argument('--output', default='profiles.json', help='JSON file of the profiles of the services')
+    parser.add_argument('--cache', help='directory where the masks are kept between runs')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--threshold', type=float, default=0.75)
+    parser.add_argument('--latency-weight', type=float, default=0.05,
+                        help='accuracy traded for each second of mean latency')
+    parser.add_argument('--report-every', type=int, default=10, help='masks between progress reports')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    run(parse_args())
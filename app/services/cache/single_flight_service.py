@@ -0,0 +1,198 @@
+"""
+Service to coalesce concurrent identical computations into a single one
+"""
+import os
+import json
+import time
+import hashlib
+from threading import Event, Lock, Timer
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # not available in every platform, so only threads of a process are coalesced
+    fcntl = None
+
+# own dependencies
+from app.services.scheduler.deadline_service import DeadlineExceededError
+
+
+class _Call:  # pylint: disable=too-few-public-methods
+    """In flight computation shared by its waiters"""
+
+    def __init__(self):
+        self.done = Event()
+        self.waiters = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlightService:
+    """
+    A class service that runs only once the computations requested concurrently with the same key
+    (i.e.: a retried upload of the same image), making the duplicated requests wait for the first one
+    and share its result or its error. Once the first one is abandoned by its own client, one of the waiters
+    takes the computation over
+
+    Optionally the computations are also coalesced across the worker processes of a host through lock
+    files in `lock_dir`, where results (which must be JSON serializable) are kept for `ttl` seconds, and
+    removed once they expire even if no other computation runs
+
+    Public methods:
+        key(*parts): Builds a key from the content and parameters of a computation
+        do(key, func, deadline=None): Runs `func` or waits for the computation in flight with the same key
+    """
+
+    # seconds a waiter waits before checking again its own deadline
+    WAIT_SLICE = 0.1
+
+    def __init__(self, max_waiters=16, lock_dir=None, ttl=30):
+        """
+        Args:
+            max_waiters (int): maximum requests waiting for the same computation, the next ones run their own
+            lock_dir (str): directory of the lock and result files to coalesce across processes (None disables it)
+            ttl (int/float): seconds that results are kept in `lock_dir` for the processes waiting for them
+        """
+        self.max_waiters = max_waiters
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.ttl = ttl
+        self._calls = {}
+        self._lock = Lock()
+        self._timer = None
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+            # results left by the processes that ended before they expired
+            self._prune()
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Builds a key from the content (bytes) and parameters (str/numbers) of a computation"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else repr(part).encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def do(self, key: str, func, deadline=None):
+        """Runs `func` or, if a computation with the same key is in flight, waits for it
+
+        Args:
+            key (str): key of the computation (see `key`)
+            func (function): computation without arguments
+            deadline (DeadlineService): deadline of the caller, it stops waiting once it passes
+
+        Returns:
+            result of the computation (the exception of the computation is raised to all its waiters, except
+            the DeadlineExceededError of the caller running it, as its deadline is not the one of its waiters)
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    leader = True
+                elif call.waiters >= self.max_waiters:
+                    # too many waiters, so this one runs on its own
+                    call, leader = None, False
+                else:
+                    call.waiters += 1
+                    leader = False
+
+            if call is None:
+                return func()
+            if leader:
+                return self._lead(key, call, func)
+
+            self._wait(call, deadline)
+            if isinstance(call.error, DeadlineExceededError):
+                # the leader was abandoned by its own client or deadline, which are not the ones of this
+                # waiter, so it takes over the computation (or waits for the waiter that took it over)
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+    def _lead(self, key: str, call: _Call, func):
+        """Runs the computation of the call and shares its result or its error with the waiters"""
+        try:
+            call.result = self._run(key, func)
+            return call.result
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _wait(self, call: _Call, deadline=None):
+        """Waits for the computation in slices of at most `WAIT_SLICE` seconds, checking between them
+        the deadline of the waiter (which may be cancelled by its client without ever reaching its timeout)"""
+        while True:
+            remaining = deadline.remaining() if deadline is not None else None
+            if call.done.wait(min(self.WAIT_SLICE, remaining) if remaining is not None else self.WAIT_SLICE):
+                return
+            if deadline is not None:
+                deadline.check()
+
+    def _run(self, key: str, func):
+        """Runs `func` holding the lock file of the key, so other processes wait and reuse its result"""
+        if not self.lock_dir:
+            return func()
+
+        path = os.path.join(self.lock_dir, key)
+        with open(path + '.lock', 'w', encoding='utf-8') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # another process may have just computed it while we were waiting for the lock
+                if os.path.exists(path + '.json') and time.time() - os.path.getmtime(path + '.json') < self.ttl:
+                    with open(path + '.json', encoding='utf-8') as stored:
+                        return json.load(stored)
+
+                result = func()
+                # readable only by the user of the workers, as it contains what was read from the document
+                with open(os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w',
+                          encoding='utf-8') as stored:
+                    json.dump(result, stored)
+                os.replace(path + '.tmp', path + '.json')
+                self._prune()
+                return result
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _prune(self):
+        """Removes the results and lock files of `lock_dir` older than `ttl`, and schedules the removal of the
+        results left, so they are not kept longer even if no other computation runs"""
+        now, expiries = time.time(), []
+        for name in os.listdir(self.lock_dir):
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if not name.endswith(('.json', '.lock')):
+                    continue
+                age = now - os.path.getmtime(path)
+                # at worst a removed lock file lets a duplicated computation run on its own
+                if age >= self.ttl:
+                    os.remove(path)
+                elif name.endswith('.json'):
+                    expiries.append(self.ttl - age)
+            except OSError:
+                # removed by another process
+                pass
+        if expiries:
+            self._schedule_prune(min(expiries))
+
+    def _schedule_prune(self, delay: float):
+        """Prunes `lock_dir` in `delay` seconds, unless a prune is already scheduled (which is never later,
+        as the results expire in the order they were written)"""
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = Timer(delay, self._scheduled_prune)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _scheduled_prune(self):
+        """Prunes `lock_dir` at the time scheduled by `_schedule_prune`"""
+        with self._lock:
+            self._timer = None
+        self._prune()
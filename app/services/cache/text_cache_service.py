@@ -0,0 +1,54 @@
+"""
+Service to keep the read text of the processed images for a while, so it can be parsed again
+"""
+import time
+from threading import Lock
+from uuid import uuid4
+
+
+class TextCacheService:
+    """
+    A class service to store the read text (or fields) of an image under an opaque handle during a
+    retention window, so that a client can parse it again with another threshold or service without
+    repeating the image processing and the OCR
+
+    Public methods:
+        store(value): Stores the value and returns its handle
+        get(handle): Returns the stored value, None if it does not exist or it has expired
+    """
+
+    def __init__(self, retention=300, max_entries=1000):
+        """
+        Args:
+            retention (int/float): seconds that a value is kept
+            max_entries (int): maximum stored values, the oldest ones are dropped first
+        """
+        self.retention = retention
+        self.max_entries = max_entries
+        # handle: (expiration, value), in insertion (and so expiration) order
+        self._entries = {}
+        self._lock = Lock()
+
+    def _prune(self, now):
+        """Drops the expired entries and the oldest ones over `max_entries`"""
+        for handle in list(self._entries):
+            if self._entries[handle][0] > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[handle]
+
+    def store(self, value) -> str:
+        """Stores the value and returns its handle, None if retention is disabled"""
+        if self.retention <= 0 or self.max_entries <= 0:
+            return None
+        handle = uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            self._entries[handle] = (now + self.retention, value)
+            self._prune(now)
+        return handle
+
+    def get(self, handle: str):
+        """Returns the stored value, None if it does not exist or it has expired"""
+        with self._lock:
+            expiration, value = self._entries.get(handle, (0, None))
+        return value if expiration > time.monotonic() else None
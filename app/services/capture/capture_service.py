@@ -0,0 +1,187 @@
+"""
+Service to capture the inputs and stage timings of slow requests, so they can be replayed offline
+"""
+import os
+import json
+import time
+import base64
+import logging
+from threading import Lock
+from uuid import uuid4
+
+try:
+    from cryptography.fernet import Fernet
+except ImportError:  # pragma: no cover
+    # cryptography is optional, without it captures can only be stored in plain
+    Fernet = None
+
+LOGGER = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """
+    A class to time the stages of a recognition, each one ending with a progress event of the pipeline
+    (i.e.: `binarized`), passing `progress` as the progress function of RecognizerService
+
+    Public methods:
+        mark(stage): Ends a stage, its seconds are the ones since the previous stage ended
+        progress(event, data=None): Ends the stage of a progress event, the `field` events are not stages
+        total(): Seconds from the start to the end of the last stage
+    """
+
+    def __init__(self):
+        self.start = self._last = time.perf_counter()
+        self.stages = {}
+
+    def mark(self, stage: str):
+        """Ends a stage, its seconds are the ones since the previous stage ended"""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.) + now - self._last
+        self._last = now
+
+    def progress(self, event: str, data=None):
+        """Ends the stage of a progress event (i.e.: `read` of the `ocr` source is `read_ocr`)"""
+        if event != 'field':
+            self.mark(f"{event}_{data['source']}" if data and 'source' in data else event)
+
+    def total(self) -> float:
+        """Seconds from the start to the end of the last stage"""
+        return self._last - self.start
+
+
+class CaptureService:
+    """
+    A class service that keeps the inputs and the stage timings of the requests slower than a threshold
+    in a ring buffer of files, the oldest ones being dropped over its number of entries or its size.
+    With a key (requires cryptography) the captures are encrypted, as they contain the uploaded documents
+
+    Public methods:
+        timer(): StageTimer of a request
+        record(content, service_name, threshold, timer, error=None): Captures the request if it was slower than
+                                                                     the threshold, even if it failed
+        entries(): Paths of the captures, oldest first
+        load(path): Capture of the path with its image as bytes
+    """
+
+    EXTENSION = '.capture'
+
+    def __init__(self, directory: str, threshold=1., max_entries=100,  # pylint: disable=too-many-arguments
+                 max_bytes=100 * 1024 * 1024, key=None):
+        """
+        Args:
+            directory (str): directory of the captures
+            threshold (int/float): seconds over which a request is captured
+            max_entries (int): maximum captures kept
+            max_bytes (int): maximum size of the captures kept
+            key (str/bytes): Fernet key to encrypt the captures (None stores them in plain)
+
+        Raises:
+            ValueError: a key is given but cryptography is not installed
+        """
+        if key and Fernet is None:
+            raise ValueError('Captures cannot be encrypted, cryptography is not installed.')
+        self.directory = directory
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.fernet = Fernet(key) if key else None
+        self._lock = Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def timer() -> StageTimer:
+        """StageTimer of a request, started now"""
+        return StageTimer()
+
+    def record(self, content: bytes, service_name: str, threshold: float,  # pylint: disable=too-many-arguments
+               timer: StageTimer, error=None):
+        """Captures the request if it was slower than the threshold. A capture that cannot be stored (i.e.: the
+        disk is full) is only logged, as capturing must never fail the request
+
+        Args:
+            content (bytes): uploaded image
+            service_name (str): name of the requested service
+            threshold (int/float): threshold of the request to tolerate the searched terms
+            timer (StageTimer): timings of the stages of the request
+            error (Exception): error that ended the request (i.e.: its DeadlineExceededError), None if it succeeded
+
+        Returns:
+            str: path of the capture, None if it was not slow enough to be captured or it could not be stored
+        """
+        total = timer.total()
+        if total < self.threshold:
+            return None
+
+        capture = {
+            'time': time.time(), 'service': service_name, 'threshold': threshold, 'total': total,
+            'stages': timer.stages, 'image': base64.b64encode(content).decode()
+        }
+        if error is not None:
+            capture['error'] = f'{type(error).__name__}: {error}'
+        try:
+            return self._store(capture)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception('Request of %s could not be captured.', service_name)
+            return None
+
+    def _store(self, capture: dict) -> str:
+        """Stores the capture, dropping the oldest ones over the limits. Returns its path"""
+        capture = json.dumps(capture).encode()
+        if self.fernet is not None:
+            capture = self.fernet.encrypt(capture)
+
+        # named by time so that the oldest ones are the first when sorted
+        path = os.path.join(self.directory, f'{time.time_ns()}-{uuid4().hex}{self.EXTENSION}')
+        try:
+            with open(path + '.tmp', 'wb') as stored:
+                stored.write(capture)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            # a partial capture is not left behind
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+            raise
+        with self._lock:
+            self._prune()
+        return path
+
+    def entries(self) -> list:
+        """Paths of the captures, oldest first"""
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(self.EXTENSION))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _prune(self):
+        """Drops the oldest captures over `max_entries` or `max_bytes`"""
+        entries = []
+        for path in self.entries():
+            try:
+                entries.append((path, os.path.getsize(path)))
+            except OSError:
+                # dropped by another process
+                pass
+
+        size = sum(entry_size for _, entry_size in entries)
+        for index, (path, entry_size) in enumerate(entries):
+            if len(entries) - index <= self.max_entries and size <= self.max_bytes:
+                break
+            size -= entry_size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def load(self, path: str) -> dict:
+        """Capture of the path, with the image as bytes
+
+        Returns:
+            dict: i.e.: {'time': 1700000000.0, 'service': 'cni', 'threshold': 0.75, 'total': 3.2,
+                         'stages': {'scheduled': 0.1, 'binarized': 2.5, ...}, 'image': b'...'}
+                  with the `error` of the request if it failed (and its last stage is `error`)
+        """
+        with open(path, 'rb') as stored:
+            capture = stored.read()
+        if self.fernet is not None:
+            capture = self.fernet.decrypt(capture)
+        capture = json.loads(capture)
+        capture['image'] = base64.b64decode(capture['image'])
+        return capture
@@ -0,0 +1,46 @@
+"""
+Service to process the items of an iterable concurrently, yielding their results in order
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+
+class OrderedService:  # pylint: disable=too-few-public-methods
+    """
+    A class service to process lazily produced items (i.e.: the pages of a document or the strips of an image)
+    with a few workers, only taking an item from the iterable when a worker is free, so that at most one item
+    per worker is alive at once
+
+    Public methods:
+        process(items, func, workers=2): Yields `func` of each item, in order, processing them concurrently
+    """
+
+    @staticmethod
+    def process(items, func, workers=2):
+        """Yields `func(item)` of each item in order, processing up to `workers` items concurrently.
+        Items are only taken from the iterable when a worker is free, and closing the generator (i.e.:
+        when the target page was found) cancels the items not started yet
+
+        Args:
+            items (iterable): items to process (a generator is closed with the returned one)
+            func (function): processing of an item
+            workers (int): items processed at the same time
+
+        Returns:
+            generator: result of each item, the exception of an item is raised when its turn comes
+        """
+        items = iter(items)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            try:
+                for item in items:
+                    pending.append(executor.submit(func, item))
+                    if len(pending) >= max(1, workers):
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+                if hasattr(items, 'close'):
+                    items.close()
@@ -3,6 +3,7 @@ Base Service to inherit from while parsing documents
 """
 # standard library imports
 import re
+from functools import partial
 from strsimpy.normalized_levenshtein import NormalizedLevenshtein
 
 
@@ -24,6 +25,15 @@ class BaseDocumentService:
     # corresponding assumptions
     TO_FIND = {}
 
+    # characters to restrict the OCR to when a field is read again from its own line region,
+    # only these fields are retried (see `process_text`)
+    WHITELISTS = {}
+
+    # layout of fixed layout documents to read the fields directly from their region (see `TemplateService`),
+    # as relative boxes (x0, y0, x1, y1) of the fields (keys of `TO_FIND`) and of the variable content
+    TEMPLATE_FIELDS = {}
+    TEMPLATE_IGNORE = []
+
     # pylint: disable=unused-argument,no-self-use
     # disable linting of unused argument of self and other args as they are later used by subclasses
     def cleaner(self, text: str) -> list:
@@ -58,13 +68,70 @@ class BaseDocumentService:
         """Specific for each document reading implementation"""
         return False
 
+    def _invalid_fields(self, associations: dict) -> list:
+        """Specific for each document reading implementation"""
+        return []
+
+    def _in_line(self, value: str, line: str) -> bool:
+        """Whether the associated value was read from the OCR line"""
+        return value in self.cleaner(line)
+
+    def _retry_fields(self, associations: dict, regions) -> dict:
+        """
+        Reads again the invalid fields from their own line region, trying the alternative binarizations
+        of `regions` with the field whitelist and stopping as soon as every field is valid
+
+        Args:
+            associations (dict): dictionary of previously generated associations
+            regions (RegionService): line regions of the read image
+
+        Returns:
+            dict: associations with the retried fields that became valid
+        """
+        invalid = self._invalid_fields(associations)
+        # a retry is only worth it if all the invalid fields can be located and retried
+        if not invalid or not all(associations[field] and field in self.WHITELISTS for field in invalid):
+            return associations
+
+        matches = {field: partial(self._in_line, associations[field]) for field in invalid}
+        for params in regions.ALTERNATIVES:
+            whitelists = {field: self.WHITELISTS[field] for field in invalid}
+            read = regions.read({field: matches[field] for field in invalid}, whitelists, params)
+            for field, text in read.items():
+                retried = dict(associations, **{field: ' '.join(self.cleaner(text))})
+                if field not in self._invalid_fields(retried):
+                    associations = retried
+            invalid = [field for field in invalid if field in self._invalid_fields(associations)]
+            if not invalid:
+                break
+        return associations
+
+    def _report_fields(self, associations: dict, on_field, reported: dict):
+        """
+        Reports through `on_field(field, value, valid)` the found fields whose value or validity changed
+        since they were last reported (`reported` keeps what was reported)
+        """
+        if on_field is None:
+            return
+        invalid = self._invalid_fields(associations)
+        for field, value in associations.items():
+            state = (value, field not in invalid)
+            if value and reported.get(field) != state:
+                reported[field] = state
+                on_field(self._standarize_key(field), *state)
+
     def _clean_processed_text(self, associations: dict) -> dict:
         """Specific for each document reading implementation"""
         return dict()
 
+    @staticmethod
+    def _standarize_key(key: str) -> str:
+        """Standarizes to lowercase a return key"""
+        return key.lower().replace(' ', '_')
+
     def _standarize_return(self, associations: dict) -> dict:
         """Standarizes to lowercase the return keys"""
-        return {key.lower().replace(' ', '_'): value for key, value in associations.items()}
+        return {self._standarize_key(key): value for key, value in associations.items()}
 
     def valid_text(self, text: str, threshold=0.75) -> bool:
         """
@@ -82,7 +149,7 @@ class BaseDocumentService:
         associations = self._associate(text_lines, threshold=threshold)
         return self._valid_association(associations)
 
-    def process_text(self, text: str, threshold=0.75) -> dict:
+    def process_text(self, text: str, threshold=0.75, regions=None, on_field=None) -> dict:
         """
         Processes the desired text and formats it into a dictionary according to the specified
         document type (class) in use
@@ -90,12 +157,43 @@ class BaseDocumentService:
         Args:
             text (str): text to validate
             threshold (optional)(int/float): threshold to use when validating the similarity of the search for key words
+            regions (optional)(RegionService): line regions of the read image, used to read again just the lines
+                                               of the fields that are not valid instead of failing
+            on_field (optional)(function): called with each found field (as it is returned), its raw value and
+                                           whether it is valid, as soon as it is associated and again if a retry
+                                           changes it
 
         Returns:
             dict: dictionary of document specified associations if valid text, None otherwise
         """
+        reported = {}
         text_lines = self.cleaner(text)
         associations = self._associate(text_lines, threshold=threshold)
+        self._report_fields(associations, on_field, reported)
+        if regions is not None:
+            associations = self._retry_fields(associations, regions)
+            self._report_fields(associations, on_field, reported)
+        return self._process_associations(associations)
+
+    def process_fields(self, fields: dict, on_field=None) -> dict:
+        """
+        Processes the fields read directly from their own region of the document (see `TemplateService`),
+        skipping the search of the key words among the lines
+
+        Args:
+            fields (dict): read text of the fields (i.e.: {'RUN': 'RUN 1.111.111-1'})
+            on_field (optional)(function): same as `process_text`
+
+        Returns:
+            dict: dictionary of document specified associations if valid fields, None otherwise
+        """
+        associations = {txt: None for txt in self.TO_FIND}
+        associations.update({field: ' '.join(self.cleaner(text)) or None for field, text in fields.items()})
+        self._report_fields(associations, on_field, {})
+        return self._process_associations(associations)
+
+    def _process_associations(self, associations: dict) -> dict:
+        """Formats the associations if they are valid, None otherwise"""
         if self._valid_association(associations):
             associations = self._clean_processed_text(associations)
             return self._standarize_return(associations)
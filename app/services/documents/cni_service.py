@@ -59,6 +59,40 @@ class CNIService(BaseDocumentService):
         'FECHA DE EMISION FECHA DE VENCIMIENTO': 1
     }
 
+    # characters in the months abbreviations (i.e.: 'ENE', 'SEPT', 'DIC')
+    MONTHS = 'ABCDEFGIJLMNOPRSTUVY'
+    # names and nationalities are written in Spanish (i.e.: 'MUÑOZ', 'JOSÉ')
+    LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZÑÁÉÍÓÚ'
+
+    # characters each field can contain, to restrict the OCR when a field is read on its own
+    # (names are never retried as they are only invalid when they are not found)
+    WHITELISTS = {
+        'RUN': 'RUN0123456789K.-',
+        'APELLIDOS': LETTERS,
+        'NOMBRES': LETTERS,
+        'NACIONALIDAD SEXO': LETTERS,
+        'FECHA DE NACIMIENTO NUMERO DOCUMENTO': '0123456789.' + MONTHS,
+        'FECHA DE EMISION FECHA DE VENCIMIENTO': '0123456789.' + MONTHS
+    }
+
+    # layout of the CNI (relative boxes as (x0, y0, x1, y1)) to read its fields directly
+    # from their region once it is aligned to the template (see `TemplateService`)
+    TEMPLATE_FIELDS = {
+        'RUN': (0.02, 0.82, 0.34, 0.92),
+        'APELLIDOS': (0.34, 0.19, 0.74, 0.305),
+        'NOMBRES': (0.34, 0.335, 0.78, 0.40),
+        'NACIONALIDAD SEXO': (0.34, 0.43, 0.74, 0.49),
+        'FECHA DE NACIMIENTO NUMERO DOCUMENTO': (0.34, 0.525, 0.80, 0.585),
+        'FECHA DE EMISION FECHA DE VENCIMIENTO': (0.34, 0.63, 0.82, 0.69)
+    }
+
+    # photos and signature, which change from one CNI to another
+    TEMPLATE_IGNORE = [
+        (0.0, 0.17, 0.34, 0.82),
+        (0.80, 0.38, 0.95, 0.58),
+        (0.34, 0.685, 0.82, 0.95)
+    ]
+
     def _associate(self, text_list: list, threshold=0.75) -> dict:
         """
         Initial association of cleaned text into the corresponding dictionary; this is fields that are
@@ -112,6 +146,18 @@ class CNIService(BaseDocumentService):
         Returns:
             bool: True if all required fields are correctly fielled, False otherwise
         """
+        return not self._invalid_fields(associations)
+
+    def _invalid_fields(self, associations: dict) -> list:
+        """
+        Finds the required fields of the document that are not correctly filled
+
+        Args:
+            associations (dict): dictionary of previously generated associations
+
+        Returns:
+            list: fields (keys of `TO_FIND`) that are not valid
+        """
         def valid_run(associations):
             run = associations['RUN']
             return bool(run) and re.match(self.PATTERNS['run'], run)
@@ -136,14 +182,15 @@ class CNIService(BaseDocumentService):
             generated_due = associations['FECHA DE EMISION FECHA DE VENCIMIENTO']
             return bool(generated_due) and re.match(self.PATTERNS['gen_due'], generated_due)
 
-        return all((
-            valid_run(associations),
-            valid_lastname(associations),
-            valid_name(associations),
-            valid_nationality_sex(associations),
-            valid_birth_doc(associations),
-            valid_generated_due(associations)
-        ))
+        validations = {
+            'RUN': valid_run(associations),
+            'APELLIDOS': valid_lastname(associations),
+            'NOMBRES': valid_name(associations),
+            'NACIONALIDAD SEXO': valid_nationality_sex(associations),
+            'FECHA DE NACIMIENTO NUMERO DOCUMENTO': valid_birth_doc(associations),
+            'FECHA DE EMISION FECHA DE VENCIMIENTO': valid_generated_due(associations)
+        }
+        return [field for field, valid in validations.items() if not valid]
 
     def _clean_processed_text(self, associations: dict) -> dict:
         """
@@ -159,15 +206,14 @@ class CNIService(BaseDocumentService):
             dict: correctly formatted associations and information
         """
         def clean_nac_sex(associations):
-            if 'NACIONALIDAD' in associations.keys():
-                nac, sex = re.match(self.PATTERNS['nac_sex'], associations['NACIONALIDAD']).groups()
-
-            elif 'NACIONALIDAD SEXO' in associations.keys():
-                nac, sex = re.match(self.PATTERNS['nac_sex'], associations['NACIONALIDAD SEXO']).groups()
-                del associations['NACIONALIDAD SEXO']
-
-            associations['NACIONALIDAD'] = nac
-            associations['SEXO'] = sex
+            # with a low threshold 'NACIONALIDAD' also matches the 'NACIONALIDAD SEXO' key word, associating
+            # it to another line, so the nationality and sex are taken from the first association with both
+            for field in ('NACIONALIDAD', 'NACIONALIDAD SEXO'):
+                match = re.match(self.PATTERNS['nac_sex'], associations.get(field) or '')
+                if match:
+                    associations['NACIONALIDAD'], associations['SEXO'] = match.groups()
+                    break
+            associations.pop('NACIONALIDAD SEXO', None)
             return associations
 
         def clean_run(associations: dict) -> dict:
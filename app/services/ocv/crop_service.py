@@ -0,0 +1,116 @@
+"""
+Service to find the boundary of a document in a photo and crop it before the binarization
+"""
+# pylint: disable=no-member
+import cv2
+import numpy as np
+
+
+class CropService:
+    """
+    A class service to find the quadrilateral of a document (i.e.: a card on a table, in a hand or on a
+    car seat) on a downscaled copy of the photo and warp only the document, so that the background neither
+    goes through the binarization and the OCR nor reaches the parser as lines of noise
+
+    Public methods:
+        find(img): Corners of the document in the image (clockwise from the top-left one), None if not found
+        warp(img, corners): Warps the quadrilateral of the image to an upright rectangle
+        crop(img): Warped document of the image, the image itself if no document is found
+    """
+
+    # the edges are searched on a downscaled copy of at most this size (largest side)
+    FIND_SIZE = 500
+
+    # area of the document relative to the photo, smaller ones are noise and larger ones are the photo itself
+    MIN_AREA = 0.1
+    MAX_AREA = 0.95
+
+    # tolerance of the polygon approximation of a contour, relative to its perimeter
+    APPROXIMATION = 0.02
+
+    # ratio of the long side to the short one of an ID-1 card (85.6 x 54 mm), with the tolerance relative to it
+    # that the perspective of the photo may distort it
+    ASPECT_RATIO = 1.586
+    ASPECT_TOLERANCE = 0.2
+
+    # edges that the document must enclose, as the text is inside it (a quadrilateral leaving most of them
+    # out is a part of the document, i.e.: the portrait of a card that fills the photo)
+    MIN_EDGES = 0.6
+
+    # largest side of the warped document, larger documents are downscaled to it
+    MAX_SIZE = 1600
+
+    @staticmethod
+    def _order(corners):
+        """Orders 4 corners as top-left, top-right, bottom-right and bottom-left"""
+        corners = corners.reshape(4, 2).astype(np.float32)
+        sums, diffs = corners.sum(axis=1), np.diff(corners, axis=1).ravel()
+        return np.array([corners[np.argmin(sums)], corners[np.argmin(diffs)],
+                         corners[np.argmax(sums)], corners[np.argmax(diffs)]], dtype=np.float32)
+
+    @staticmethod
+    def _sides(corners):
+        """Width and height of the quadrilateral of the ordered corners (the longest of its opposite sides)"""
+        top_left, top_right, bottom_right, bottom_left = corners
+        width = max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left))
+        height = max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right))
+        return width, height
+
+    def _plausible(self, polygon, edges) -> bool:
+        """Whether the quadrilateral is plausibly the whole document: its sides are in the proportion of an
+        ID-1 card and it encloses most of the edges of the photo"""
+        width, height = self._sides(self._order(polygon))
+        aspect = max(width, height) / max(1., min(width, height))
+        if abs(aspect / self.ASPECT_RATIO - 1) > self.ASPECT_TOLERANCE:
+            return False
+        # the outline is included, as the edges of the border lie on both sides of it
+        inside = np.zeros_like(edges)
+        cv2.fillConvexPoly(inside, polygon.reshape(-1, 2), 255)
+        cv2.polylines(inside, [polygon.reshape(-1, 2)], True, 255, 5)
+        return np.count_nonzero(edges[inside > 0]) >= self.MIN_EDGES * np.count_nonzero(edges)
+
+    def find(self, img):
+        """Corners of the largest convex quadrilateral of the edges of the image that is plausibly the whole
+        document (see `_plausible`), in the scale of the image. A card filling the photo has no outline to find,
+        and then its inner rectangles (i.e.: the portrait) are not taken for it
+
+        Args:
+            img (cv2 image): photo of the document
+
+        Returns:
+            numpy array: corners (4, 2) as top-left, top-right, bottom-right and bottom-left, None if not found
+        """
+        downscale = min(1., self.FIND_SIZE / max(img.shape[:2]))
+        small = cv2.resize(img, None, fx=downscale, fy=downscale, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+        # closing the edges joins the border of the document where its contrast with the background is low
+        edges = cv2.Canny(gray, 50, 150)
+        closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
+        contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        area = gray.shape[0] * gray.shape[1]
+        for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+            if cv2.contourArea(contour) < self.MIN_AREA * area:
+                break
+            polygon = cv2.approxPolyDP(contour, self.APPROXIMATION * cv2.arcLength(contour, True), True)
+            if len(polygon) == 4 and cv2.isContourConvex(polygon) and \
+                    cv2.contourArea(polygon) <= self.MAX_AREA * area and self._plausible(polygon, edges):
+                return self._order(polygon) / downscale
+        return None
+
+    def warp(self, img, corners):
+        """Warps the quadrilateral of the image to an upright rectangle of the size of its sides (at most `MAX_SIZE`)"""
+        width, height = self._sides(corners)
+        scale = min(1., self.MAX_SIZE / max(width, height))
+        width, height = int(round(width * scale)), int(round(height * scale))
+
+        target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+        return cv2.warpPerspective(img, cv2.getPerspectiveTransform(corners, target), (width, height))
+
+    def crop(self, img):
+        """Warped document of the image (see `find` and `warp`), the image itself if no document is found"""
+        corners = self.find(img)
+        if corners is None:
+            return img
+        return self.warp(img, corners.astype(np.float32))
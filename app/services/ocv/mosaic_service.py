@@ -0,0 +1,111 @@
+"""
+Service to OCR many small crops with a single Tesseract call by packing them into a mosaic
+"""
+# pylint: disable=no-member
+import cv2
+import pytesseract
+import numpy as np
+
+# own dependencies
+from app.services.scheduler.deadline_service import DeadlineService
+
+
+class MosaicService:
+    """
+    A class service to pack small (binarized) crops into one padded mosaic image, so that the fixed
+    overhead of each Tesseract call is paid once, and to map the read words back to their crops
+
+    Public methods:
+        pack(crops, padding=32, max_width=2000): Packs the crops into shelves of a white mosaic
+        assign(data, boxes): Maps the word level output of Tesseract back to each crop
+        read(crops, config='', padding=32, max_width=2000, deadline=None): Reads the text of every crop with one call
+    """
+
+    # white background, as the binarized images are black text over white
+    BACKGROUND = 255
+
+    @staticmethod
+    def _gray(crop):
+        """Mosaics are single channel, so colored crops are converted"""
+        if crop.ndim == 3:
+            return cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        return crop
+
+    @staticmethod
+    def pack(crops: list, padding=32, max_width=2000):
+        """Packs the crops into shelves (rows) of a white mosaic, tallest crops first
+
+        Args:
+            crops (list): list of cv2 images to pack
+            padding (int): blank space around every crop, large enough so Tesseract does not join
+                           words of neighbouring crops
+            max_width (int): maximum width of the mosaic (widened if a single crop is wider)
+
+        Returns:
+            tuple: the mosaic (cv2 image) and the list of boxes (x, y, w, h) of each crop in it, in the same
+                   order as `crops`
+        """
+        crops = [MosaicService._gray(crop) for crop in crops]
+        max_width = max([max_width] + [crop.shape[1] + 2 * padding for crop in crops])
+
+        boxes = [None] * len(crops)
+        shelf_x, shelf_y, shelf_height = padding, padding, 0
+        for i in sorted(range(len(crops)), key=lambda i: -crops[i].shape[0]):
+            height, width = crops[i].shape[:2]
+            if shelf_x + width + padding > max_width:
+                # next shelf
+                shelf_x, shelf_y, shelf_height = padding, shelf_y + shelf_height + padding, 0
+            boxes[i] = (shelf_x, shelf_y, width, height)
+            shelf_x += width + padding
+            shelf_height = max(shelf_height, height)
+
+        mosaic = np.full((shelf_y + shelf_height + padding, max_width), MosaicService.BACKGROUND, dtype=np.uint8)
+        for crop, (__x, __y, width, height) in zip(crops, boxes):
+            mosaic[__y:__y + height, __x:__x + width] = crop
+        return mosaic, boxes
+
+    @staticmethod
+    def assign(data: dict, boxes: list) -> list:
+        """Maps the word level output of Tesseract back to each crop by the center of the words
+
+        Args:
+            data (dict): output of `pytesseract.image_to_data` as a dictionary
+            boxes (list): boxes (x, y, w, h) of the crops in the mosaic
+
+        Returns:
+            list: read text of each crop (lines separated by '\\n'), in the same order as `boxes`
+        """
+        # for each crop we keep its lines in reading order as {line: [words]}
+        lines = [{} for _ in boxes]
+        for i, word in enumerate(data['text']):
+            if not word or not word.strip():
+                continue
+            center_x = data['left'][i] + data['width'][i] / 2
+            center_y = data['top'][i] + data['height'][i] / 2
+            for j, (__x, __y, width, height) in enumerate(boxes):
+                if __x <= center_x < __x + width and __y <= center_y < __y + height:
+                    line = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+                    lines[j].setdefault(line, []).append(word.strip())
+                    break
+        return ['\n'.join(' '.join(words) for words in crop_lines.values()) for crop_lines in lines]
+
+    @staticmethod
+    def read(crops: list, config='', padding=32, max_width=2000, deadline=None) -> list:
+        """Reads the text of every crop with a single Tesseract call
+
+        Args:
+            crops (list): list of (binarized) cv2 images
+            config (str): extra Tesseract configuration (i.e.: a character whitelist)
+            padding (int): blank space around every crop in the mosaic
+            max_width (int): maximum width of the mosaic
+            deadline (DeadlineService): deadline of the request (None for no deadline)
+
+        Returns:
+            list: read text of each crop, in the same order as `crops`
+        """
+        if not crops:
+            return []
+        mosaic, boxes = MosaicService.pack(crops, padding=padding, max_width=max_width)
+        deadline = deadline or DeadlineService()
+        data = deadline.tesseract(pytesseract.image_to_data, mosaic, config=config, output_type=pytesseract.Output.DICT)
+        return MosaicService.assign(data, boxes)
@@ -1,11 +1,20 @@
 """
 Service to provide a wrapper around OCV that returns the read strings from an image
 """
-# pylint: disable=no-member
+# pylint: disable=no-member,too-many-arguments
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import cv2
 import pytesseract
 import numpy as np
 
+# own dependencies
+from app.services.concurrency.ordered_service import OrderedService
+from app.services.ocv.mosaic_service import MosaicService
+from app.services.ocv.region_service import RegionService
+from app.services.scheduler.deadline_service import DeadlineService
+
 
 class OCVServiceWrappers:
     """
@@ -53,9 +62,33 @@ class OCVService:
 
     Public methods:
         adjust_gamma(image, gamma=1): Builds a lookup table mapping the pixel values [0, 255] to their adjusted gamma
-        process_image(img, block_size=80, delta=50): Pipeline of segmenting into regions
-        combine_process(img, mask): Executes whole pipeline and returns a mask for the original image
-        process(img_name, gamma=1, block_size=80, delta=50): Processes the image with an 'adaptive binarization'
+        process_image(img, block_size=80, delta=50, workers=1): Pipeline of segmenting into regions
+        combine_process(img, mask, block_size=20, workers=1): Executes whole pipeline and returns a mask for the
+                                                               original image
+        binarize(img, gamma=1, block_size=80, delta=50, workers=1): Whole 'adaptive binarization' of a cv2 image
+        binarize_strips(img, gamma=1, block_size=80, delta=50, strip_height=512, workers=1): Same as `binarize`,
+                                                                                             yielding it by strips
+        process(img_name, gamma=1, block_size=80, delta=50, workers=1): Processes the image with an
+                                                                          'adaptive binarization'
+        process_regions(img_name, gamma=1, block_size=80, delta=50, workers=1): Same as `process` but also keeps
+                                                                                  the line regions
+        read_regions(img, gamma=1, block_size=80, delta=50, workers=1): Same as `process_regions` from a cv2 image
+        process_batch(images, gamma=1, block_size=80, delta=50, config=''): Processes many small images with a
+                                                                             single OCR call
+
+    `binarize`, `process`, `process_regions` and `read_regions` also take the size of the blocks of the
+    combination stage (`combine_block_size`, 20 by default) and the height of the strips to binarize the
+    image by (`strip_height`, 0 binarizes it whole).
+
+    The block stages can split the image into horizontal bands that are processed on a thread pool
+    (`workers` > 1, or `workers` <= 0 to adapt to the current load); the result is identical to the serial one.
+
+    With `strip_height` the whole pipeline runs strip by strip instead (each strip with the rows around it that
+    its blocks read), so that the copies of each stage are the size of a strip rather than of the image, which
+    bounds the peak memory of large scans; the result is identical too.
+
+    Every public method also takes the `deadline` (see `DeadlineService`) of the request, checked between
+    the stages and the block rows and passed to the OCR call, which raises DeadlineExceededError once it passes.
     """
 
     @staticmethod
@@ -100,31 +133,82 @@ class OCVService:
         return img_out
 
     @staticmethod
-    def _block_image_process(image, block_size, delta):
+    def _adaptive_workers():
+        """Number of cores that are idle accordingly to the current system load"""
+        cpus = os.cpu_count() or 1
+        try:
+            load = os.getloadavg()[0]
+        except (AttributeError, OSError):
+            # not available in every platform, so we assume an idle system
+            return cpus
+        return max(1, cpus - int(round(load)))
+
+    @staticmethod
+    def _block_rows_process(image, masks, rows, block_size, block_func, deadline=None):
         """
-        Divides the image into local regions regions (blocks), and perform the `adaptive_mean_threshold(...)`
-        function to each of the regions.
+        Applies `block_func` to every block centered in `rows` and returns the top offset and the processed
+        band, which spans from the top of the first block to the bottom of the last one (halo included)
         """
-        out_image = np.zeros_like(image)
-        for row in range(0, image.shape[0], block_size):
+        deadline = deadline or DeadlineService()
+        top = max(0, rows[0] - block_size)
+        bottom = min(image.shape[0], rows[-1] + block_size)
+        band = image[top:bottom]
+        band_masks = [mask[top:bottom] for mask in masks]
+        out_band = np.zeros_like(band)
+        for row in rows:
+            deadline.check()
             for col in range(0, image.shape[1], block_size):
-                idx = (row, col)
-                block_idx = OCVService._get_block_index(image.shape, idx, block_size)
-                out_image[tuple(block_idx)] = OCVService._adaptive_median_threshold(image[tuple(block_idx)], delta)
+                block_idx = tuple(OCVService._get_block_index(band.shape, (row - top, col), block_size))
+                out_band[block_idx] = block_func(band[block_idx], *[mask[block_idx] for mask in band_masks])
+        return top, out_band
+
+    @staticmethod
+    def _blockwise_process(image, block_size, block_func, *masks, workers=1, deadline=None):
+        """
+        Runs `block_func` over all the blocks of the image. With more than one worker the block rows are
+        split into horizontal bands processed concurrently and then stitched in order, so each overlapping
+        row keeps the value of the last block that wrote it, exactly as in the serial traversal
+        """
+        rows = list(range(0, image.shape[0], block_size))
+        out_image = np.zeros_like(image)
+        if not rows:
+            return out_image
+
+        workers = workers if workers > 0 else OCVService._adaptive_workers()
+        bands = [list(band) for band in np.array_split(rows, min(workers, len(rows)))]
+        process_band = partial(OCVService._block_rows_process, image, masks,
+                               block_size=block_size, block_func=block_func, deadline=deadline)
+        if len(bands) == 1:
+            results = [process_band(bands[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=len(bands)) as executor:
+                results = list(executor.map(process_band, bands))
+
+        for top, out_band in results:
+            out_image[top:top + out_band.shape[0]] = out_band
         return out_image
 
+    @staticmethod
+    def _block_image_process(image, block_size, delta, workers=1, deadline=None):
+        """
+        Divides the image into local regions regions (blocks), and perform the `adaptive_mean_threshold(...)`
+        function to each of the regions.
+        """
+        block_func = partial(OCVService._adaptive_median_threshold, delta=delta)
+        return OCVService._blockwise_process(image, block_size, block_func, workers=workers, deadline=deadline)
+
     @staticmethod
     @OCVServiceWrappers.type_error_wrapper([
-        ('image', type(np.ndarray)), ('block_size', int), ('delta', (int, float))
+        ('image', type(np.ndarray)), ('block_size', int), ('delta', (int, float)), ('workers', int)
     ])
     @OCVServiceWrappers.value_error_wrapper([
         ('block_size', 0), ('delta', 0)
     ])
-    def process_image(img, block_size=80, delta=50):
+    def process_image(img, block_size=80, delta=50, workers=1, deadline=None):
         """Pipeline of segmenting into regions. Returns a cv2 image"""
         image_in = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         image_in = OCVService._preprocess(image_in)
-        image_out = OCVService._block_image_process(image_in, block_size, delta)
+        image_out = OCVService._block_image_process(image_in, block_size, delta, workers=workers, deadline=deadline)
         image_out = OCVService._postprocess(image_out)
         return image_out
 
@@ -141,7 +225,6 @@ class OCVService:
         # (i.e. background). The mask is retrieved from previous section.
         img_out = np.zeros_like(img_in)
         img_out[mask == 255] = 255
-        fimg_in = img_in.astype(np.float32)
 
         # Then, we store the foreground (letters written with ink)
         # in the `idx` array. If there are none (i.e. just background),
@@ -152,10 +235,12 @@ class OCVService:
             return img_out
 
         # We find the intensity range of our pixels in this local part
-        # and clip the image block to that range, locally.
-        _lo = fimg_in[idx].min()
-        _hi = fimg_in[idx].max()
-        __v = fimg_in[idx] - _lo
+        # and clip the image block to that range, locally (only the
+        # foreground is copied as float).
+        fimg_in = img_in[idx].astype(np.float32)
+        _lo = fimg_in.min()
+        _hi = fimg_in.max()
+        __v = fimg_in - _lo
         __r = _hi - _lo
 
         # Now we use good old OTSU binarization to get a rough estimation
@@ -175,18 +260,13 @@ class OCVService:
         return img_out
 
     @staticmethod
-    def _combine_block_image_process(image, mask, block_size):
+    def _combine_block_image_process(image, mask, block_size, workers=1, deadline=None):
         """
         Combination routine on local blocks, so that the scaling parameters
         of Sigmoid function can be adjusted to local setting
         """
-        out_image = np.zeros_like(image)
-        for row in range(0, image.shape[0], block_size):
-            for col in range(0, image.shape[1], block_size):
-                idx = (row, col)
-                block_idx = OCVService._get_block_index(image.shape, idx, block_size)
-                out_image[tuple(block_idx)] = OCVService._combine_block(image[tuple(block_idx)], mask[tuple(block_idx)])
-        return out_image
+        return OCVService._blockwise_process(image, block_size, OCVService._combine_block, mask,
+                                             workers=workers, deadline=deadline)
 
     @staticmethod
     def _combine_postprocess(image):
@@ -194,23 +274,122 @@ class OCVService:
 
     @staticmethod
     @OCVServiceWrappers.type_error_wrapper([
-        ('image', type(np.ndarray)), ('mask', type(np.ndarray))
+        ('image', type(np.ndarray)), ('mask', type(np.ndarray)), ('block_size', int), ('workers', int)
     ])
-    def combine_process(image, mask):
+    @OCVServiceWrappers.value_error_wrapper([
+        ('block_size', 0)
+    ])
+    def combine_process(image, mask, block_size=20, workers=1, deadline=None):
         """Executes whole pipeline and returns a mask for the original image. Returns cv2 image"""
         image_in = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        image_out = OCVService._combine_block_image_process(image_in, mask, 20)
+        image_out = OCVService._combine_block_image_process(image_in, mask, block_size, workers=workers,
+                                                            deadline=deadline)
         image_out = OCVService._combine_postprocess(image_out)
         return image_out
 
+    @staticmethod
+    def _strip_rows(bounds, height, block_size):
+        """Block rows (the centers of the blocks) whose blocks write the rows [start, end) of an image and the
+        rows [top, bottom) that those blocks read. Returns tuple (block rows, top, bottom)"""
+        start, end = bounds
+        rows = list(range((max(0, start - block_size) // block_size) * block_size, min(height, end + block_size),
+                          block_size))
+        rows = [row for row in rows if row > start - block_size]
+        return rows, max(0, rows[0] - block_size), min(height, rows[-1] + block_size)
+
+    @staticmethod
+    def _mask_strip(img, bounds, gamma, block_size, delta, deadline=None):
+        """Rows [start, end) of the mask of `process_image` (of the gamma adjusted image), computed only from
+        the rows around them that they depend on"""
+        height = img.shape[0]
+        # the opening of the postprocess reads 2 rows around each row, and the median blur 1
+        outer = (max(0, bounds[0] - 2), min(height, bounds[1] + 2))
+        rows, top, bottom = OCVService._strip_rows(outer, height, block_size)
+        blur = (max(0, top - 1), min(height, bottom + 1))
+
+        strip = cv2.cvtColor(OCVService.adjust_gamma(img[blur[0]:blur[1]], gamma=gamma), cv2.COLOR_BGR2GRAY)
+        strip = OCVService._preprocess(strip)[top - blur[0]:bottom - blur[0]]
+        _, mask = OCVService._block_rows_process(strip, [], [row - top for row in rows], block_size,
+                                                 partial(OCVService._adaptive_median_threshold, delta=delta),
+                                                 deadline=deadline)
+        mask = OCVService._postprocess(mask[outer[0] - top:outer[1] - top])
+        return mask[bounds[0] - outer[0]:bounds[1] - outer[0]]
+
+    @staticmethod
+    def _binarize_strip(img, bounds, gamma=1, block_size=80, delta=50, combine_block_size=20, deadline=None):
+        """Rows [start, end) of `binarize`, computed only from the rows around them that they depend on"""
+        start, end = bounds
+        rows, top, bottom = OCVService._strip_rows(bounds, img.shape[0], combine_block_size)
+        mask = OCVService._mask_strip(img, (top, bottom), gamma, block_size, delta, deadline=deadline)
+        strip = cv2.cvtColor(img[top:bottom], cv2.COLOR_BGR2GRAY)
+        _, strip = OCVService._block_rows_process(strip, [mask], [row - top for row in rows], combine_block_size,
+                                                  OCVService._combine_block, deadline=deadline)
+        return start, strip[start - top:end - top]
+
     @staticmethod
     @OCVServiceWrappers.type_error_wrapper([
-        ('img_name', str), ('gamma', (int, float)), ('block_size', int), ('delta', (int, float))
+        ('gamma', (int, float)), ('block_size', int), ('delta', (int, float)), ('combine_block_size', int),
+        ('strip_height', int), ('workers', int)
     ])
     @OCVServiceWrappers.value_error_wrapper([
-        ('gamma', 0), ('block_size', 0), ('delta', 0)
+        ('gamma', 0), ('block_size', 0), ('delta', 0), ('combine_block_size', 0), ('strip_height', 0)
+    ])
+    def binarize_strips(img, gamma=1, block_size=80, delta=50, combine_block_size=20, strip_height=512, workers=1,
+                        deadline=None):
+        """Applies the whole 'adaptive binarization' to a cv2 image strip by strip, so that only the copies
+        of a few strips (one per worker) are alive at once instead of the ones of the whole image
+
+        Args:
+            img (cv2 image): image to binarize
+            gamma, block_size, delta, combine_block_size: same as `process`
+            strip_height (int): rows of each strip
+            workers (int): strips binarized concurrently (0 or less adapts it to the idle cores)
+            deadline (DeadlineService): deadline of the request (None for no deadline)
+
+        Returns:
+            generator: the top row and the binarized rows (cv2 image) of each strip, in order
+        """
+        workers = workers if workers > 0 else OCVService._adaptive_workers()
+        bounds = [(start, min(img.shape[0], start + strip_height)) for start in range(0, img.shape[0], strip_height)]
+        binarize_strip = partial(OCVService._binarize_strip, img, gamma=gamma, block_size=block_size, delta=delta,
+                                 combine_block_size=combine_block_size, deadline=deadline)
+        # only a strip per worker is binarized ahead, as the pages of a document
+        yield from OrderedService.process(bounds, binarize_strip, workers=workers)
+
+    @staticmethod
+    @OCVServiceWrappers.type_error_wrapper([
+        ('gamma', (int, float)), ('block_size', int), ('delta', (int, float)), ('combine_block_size', int),
+        ('workers', int), ('strip_height', int)
+    ])
+    @OCVServiceWrappers.value_error_wrapper([
+        ('gamma', 0), ('block_size', 0), ('delta', 0), ('combine_block_size', 0), ('strip_height', -1)
     ])
-    def process(img_name, gamma=1, block_size=80, delta=50) -> str:
+    def binarize(img, gamma=1, block_size=80, delta=50, combine_block_size=20, workers=1, deadline=None,
+                 strip_height=0):
+        """Applies the whole 'adaptive binarization' to a cv2 image (see `process`), by strips that are stitched
+        into the output if `strip_height` is given (see `binarize_strips`). Returns cv2 image"""
+        if strip_height:
+            out = np.empty(img.shape[:2], dtype=np.uint8)
+            for top, strip in OCVService.binarize_strips(img, gamma=gamma, block_size=block_size, delta=delta,
+                                                         combine_block_size=combine_block_size,
+                                                         strip_height=strip_height, workers=workers, deadline=deadline):
+                out[top:top + strip.shape[0]] = strip
+            return out
+
+        mask = OCVService.adjust_gamma(img, gamma=gamma)
+        mask = OCVService.process_image(mask, block_size=block_size, delta=delta, workers=workers, deadline=deadline)
+        return OCVService.combine_process(img, mask, block_size=combine_block_size, workers=workers, deadline=deadline)
+
+    @staticmethod
+    @OCVServiceWrappers.type_error_wrapper([
+        ('img_name', str), ('gamma', (int, float)), ('block_size', int), ('delta', (int, float)),
+        ('combine_block_size', int), ('workers', int), ('strip_height', int)
+    ])
+    @OCVServiceWrappers.value_error_wrapper([
+        ('gamma', 0), ('block_size', 0), ('delta', 0), ('combine_block_size', 0), ('strip_height', -1)
+    ])
+    def process(img_name, gamma=1, block_size=80, delta=50, combine_block_size=20, workers=1,
+                deadline=None, strip_height=0) -> str:
         """Processes the image with an 'adaptive binarization' to extract the text in it
 
         Args:
@@ -221,14 +400,116 @@ class OCVService:
                               (i.e. larger than any symbols that you have), but small enough to not suffer
                               from any lightening condition variations (i.e. 'large, but still local')
             delta (int): Threshold of 'how far away from median we will still consider it as background?'
+            combine_block_size (int): Size of the blocks where the foreground is rescaled to its local range
+            workers (int): Number of horizontal bands processed concurrently by the block stages
+                           (1 is serial, 0 or less adapts it to the idle cores), or of strips with `strip_height`
+            deadline (DeadlineService): deadline of the request (None for no deadline)
+            strip_height (int): Rows of the strips to binarize the image by, bounding the peak memory
+                                (0 binarizes it whole, see `binarize_strips`)
 
         Returns:
             string: a string of the processed text and what it is being identified in the image
         """
+        deadline = deadline or DeadlineService()
 
         img = cv2.imread(img_name)
-        mask = OCVService.adjust_gamma(img, gamma=gamma)
-        mask = OCVService.process_image(mask, block_size=block_size, delta=delta)
-        new_img = OCVService.combine_process(img, mask)
+        new_img = OCVService.binarize(img, gamma=gamma, block_size=block_size, delta=delta,
+                                      combine_block_size=combine_block_size, workers=workers, deadline=deadline,
+                                      strip_height=strip_height)
+
+        return deadline.tesseract(pytesseract.image_to_string, new_img)
 
-        return pytesseract.image_to_string(new_img)
+    @staticmethod
+    def _data_lines(data: dict) -> tuple:
+        """Rebuilds the text (as Tesseract outputs it) and the line boxes from the word level output"""
+        lines = {}
+        for i, word in enumerate(data['text']):
+            if not word or not word.strip():
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            box = (data['left'][i], data['top'][i],
+                   data['left'][i] + data['width'][i], data['top'][i] + data['height'][i])
+            words, bounds = lines.get(key, ([], box))
+            bounds = (min(bounds[0], box[0]), min(bounds[1], box[1]), max(bounds[2], box[2]), max(bounds[3], box[3]))
+            lines[key] = (words + [word], bounds)
+
+        text, paragraph = '', None
+        for (block, par, _), (words, _) in lines.items():
+            # paragraphs are separated by an empty line
+            if paragraph is not None:
+                text += '\n' if paragraph == (block, par) else '\n\n'
+            text += ' '.join(words)
+            paragraph = (block, par)
+
+        boxes = [(' '.join(words), (left, top, right - left, bottom - top))
+                 for words, (left, top, right, bottom) in lines.values()]
+        return text + '\n', boxes
+
+    @staticmethod
+    @OCVServiceWrappers.type_error_wrapper([
+        ('img_name', str), ('gamma', (int, float)), ('block_size', int), ('delta', (int, float)),
+        ('combine_block_size', int), ('workers', int), ('strip_height', int)
+    ])
+    @OCVServiceWrappers.value_error_wrapper([
+        ('gamma', 0), ('block_size', 0), ('delta', 0), ('combine_block_size', 0), ('strip_height', -1)
+    ])
+    def process_regions(img_name, gamma=1, block_size=80, delta=50, combine_block_size=20, workers=1,
+                        deadline=None, strip_height=0) -> tuple:
+        """Same as `process`, but keeps the bounding boxes of the read lines so that single lines can be
+        read again (see `RegionService`)
+
+        Returns:
+            tuple: a string of the processed text and the `RegionService` of its lines
+        """
+        img = cv2.imread(img_name)
+        return OCVService.read_regions(img, gamma=gamma, block_size=block_size, delta=delta,
+                                       combine_block_size=combine_block_size, workers=workers, deadline=deadline,
+                                       strip_height=strip_height)
+
+    @staticmethod
+    @OCVServiceWrappers.type_error_wrapper([
+        ('img', type(np.ndarray)), ('gamma', (int, float)), ('block_size', int), ('delta', (int, float)),
+        ('combine_block_size', int), ('workers', int), ('strip_height', int)
+    ])
+    @OCVServiceWrappers.value_error_wrapper([
+        ('gamma', 0), ('block_size', 0), ('delta', 0), ('combine_block_size', 0), ('strip_height', -1)
+    ])
+    def read_regions(img, gamma=1, block_size=80, delta=50, combine_block_size=20, workers=1,
+                     deadline=None, progress=None, strip_height=0) -> tuple:
+        """Same as `process_regions` from a cv2 image (i.e.: a page of a multi-page document), calling
+        `progress('binarized')` (if given) once the image is binarized, before the OCR"""
+        deadline = deadline or DeadlineService()
+
+        new_img = OCVService.binarize(img, gamma=gamma, block_size=block_size, delta=delta,
+                                      combine_block_size=combine_block_size, workers=workers, deadline=deadline,
+                                      strip_height=strip_height)
+        if progress is not None:
+            progress('binarized')
+
+        data = deadline.tesseract(pytesseract.image_to_data, new_img, output_type=pytesseract.Output.DICT)
+        text, lines = OCVService._data_lines(data)
+        return text, RegionService(img, lines, OCVService.binarize, deadline=deadline)
+
+    @staticmethod
+    @OCVServiceWrappers.type_error_wrapper([
+        ('images', list), ('gamma', (int, float)), ('block_size', int), ('delta', (int, float)), ('config', str)
+    ])
+    @OCVServiceWrappers.value_error_wrapper([
+        ('gamma', 0), ('block_size', 0), ('delta', 0)
+    ])
+    def process_batch(images, gamma=1, block_size=80, delta=50, config='', deadline=None) -> list:
+        """Processes many small images (i.e.: fields of a document) with a single OCR call, packing
+        them binarized into a mosaic, as the fixed overhead of each OCR call dominates for small crops
+
+        Args:
+            images (list): list of cv2 images (crops)
+            gamma, block_size, delta: same as `process`
+            config (str): extra Tesseract configuration (i.e.: a character whitelist)
+            deadline (DeadlineService): deadline of the request (None for no deadline)
+
+        Returns:
+            list: a string of the read text for each image, in the same order
+        """
+        crops = [OCVService.binarize(img, gamma=gamma, block_size=block_size, delta=delta, deadline=deadline)
+                 for img in images]
+        return MosaicService.read(crops, config=config, deadline=deadline)
@@ -0,0 +1,111 @@
+"""
+Service to decode the pages of multi-page documents (PDF/TIFF) lazily
+"""
+# pylint: disable=no-member
+import cv2
+import numpy as np
+from PIL import Image
+
+try:
+    import fitz
+except ImportError:  # pragma: no cover
+    # PyMuPDF is optional, without it only images and TIFFs are supported
+    fitz = None
+
+# own dependencies
+from app.services.recognizer.recognizer_service import ImageDecodeError
+
+
+class PageService:  # pylint: disable=too-few-public-methods
+    """
+    A class service to iterate the pages of an uploaded file as cv2 images, decoding one page at a time
+    so that a long document is never materialized whole in memory (see `OrderedService` to process them
+    concurrently with only a few pages decoded ahead)
+
+    Public methods:
+        pages(file_path, extension): Yields the pages of a PDF, a TIFF or an image as cv2 images
+    """
+
+    # resolution at which the pages of a PDF are rendered
+    PDF_DPI = 200
+
+    # conversion of the rendered pages to BGR by their number of channels (gray, RGB and RGB with alpha)
+    PIXMAP_CONVERSIONS = {1: cv2.COLOR_GRAY2BGR, 3: cv2.COLOR_RGB2BGR, 4: cv2.COLOR_RGBA2BGR}
+
+    @staticmethod
+    def _tiff_pages(file_path: str):
+        """Yields the frames of a (multi-page) TIFF, seeking one at a time
+
+        Raises:
+            ImageDecodeError: the file is not a TIFF or a frame cannot be decoded (without the path of the file
+                              in the message, unlike the errors of Pillow)
+        """
+        try:
+            tiff = Image.open(file_path)
+        except OSError as error:
+            raise ImageDecodeError('TIFF file cannot be read.') from error
+        with tiff:
+            for index in range(getattr(tiff, 'n_frames', 1)):
+                try:
+                    tiff.seek(index)
+                    page = cv2.cvtColor(np.asarray(tiff.convert('RGB')), cv2.COLOR_RGB2BGR)
+                except (OSError, EOFError, ValueError) as error:
+                    raise ImageDecodeError(f'Page {index + 1} of the TIFF file cannot be read.') from error
+                yield page
+
+    @staticmethod
+    def _pdf_page(page, number: int):
+        """Renders a page of a PDF as a cv2 image
+
+        Raises:
+            ImageDecodeError: the page cannot be rendered or its channels are not supported
+        """
+        try:
+            pixmap = page.get_pixmap(dpi=PageService.PDF_DPI)
+        except (RuntimeError, ValueError) as error:
+            raise ImageDecodeError(f'Page {number} of the PDF file cannot be read.') from error
+        if pixmap.n not in PageService.PIXMAP_CONVERSIONS:
+            raise ImageDecodeError(f'PDF pages with {pixmap.n} channels are not supported.')
+        pixels = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, -1)
+        return cv2.cvtColor(pixels, PageService.PIXMAP_CONVERSIONS[pixmap.n])
+
+    @staticmethod
+    def _pdf_pages(file_path: str):
+        """Yields the pages of a PDF rendered one at a time
+
+        Raises:
+            ImageDecodeError: PyMuPDF is not installed, the file is not a PDF or a page cannot be rendered
+        """
+        if fitz is None:
+            raise ImageDecodeError('PDF files are not supported, PyMuPDF is not installed.')
+        try:
+            # the uploads are saved without extension, so the type is not guessed from it
+            document = fitz.open(file_path, filetype='pdf')
+        except (RuntimeError, ValueError) as error:
+            # FileDataError of PyMuPDF is a RuntimeError
+            raise ImageDecodeError('PDF file cannot be read.') from error
+        with document:
+            for number, page in enumerate(document, 1):
+                yield PageService._pdf_page(page, number)
+
+    @staticmethod
+    def pages(file_path: str, extension: str):
+        """Yields the pages of the file as cv2 images (a single page for the other images)
+
+        Args:
+            file_path (str): path of the file
+            extension (str): extension of the original name of the file (i.e.: 'pdf')
+
+        Raises:
+            ImageDecodeError: the file cannot be decoded
+        """
+        extension = extension.lower()
+        if extension == 'pdf':
+            yield from PageService._pdf_pages(file_path)
+        elif extension in ('tif', 'tiff'):
+            yield from PageService._tiff_pages(file_path)
+        else:
+            img = cv2.imread(file_path)
+            if img is None:
+                raise ImageDecodeError('Image cannot be read.')
+            yield img
@@ -0,0 +1,79 @@
+"""
+Service to read again single lines of an already read image
+"""
+# own dependencies
+from app.services.ocv.mosaic_service import MosaicService
+
+
+class RegionService:
+    """
+    A class service that keeps the line regions read from an image, so that a single field that
+    fails its validation can be read again from its own line instead of the whole image
+
+    Public methods:
+        locate(match): Finds the box of the first line that satisfies `match`
+        read(matches, whitelists, params): Reads again the matched lines with an alternative binarization
+    """
+
+    # alternative binarization parameters tried in order when reading a line again,
+    # tuned for line sized crops instead of whole documents
+    ALTERNATIVES = [
+        {'gamma': 1, 'block_size': 40, 'delta': 30},
+        {'gamma': 1.5, 'block_size': 40, 'delta': 50},
+        {'gamma': 0.7, 'block_size': 80, 'delta': 70}
+    ]
+
+    # margin added around the line box, relative to its height
+    MARGIN = 0.3
+
+    def __init__(self, image, lines: list, binarize, deadline=None):
+        """
+        Args:
+            image (cv2 image): original (not binarized) image
+            lines (list): list of read lines and their boxes (i.e.: [('RUN 1.111.111-1', (x, y, w, h))])
+            binarize (function): binarization to apply to the crops (see `OCVService.binarize`)
+            deadline (DeadlineService): deadline of the request the image belongs to (None for no deadline)
+        """
+        self.image = image
+        self.lines = lines
+        self.binarize = binarize
+        self.deadline = deadline
+
+    def locate(self, match):
+        """Finds the box (x, y, w, h) of the first line that satisfies `match`, None if there is none"""
+        for text, box in self.lines:
+            if match(text):
+                return box
+        return None
+
+    def _crop(self, box):
+        """Crops the box with its margin from the original image"""
+        __x, __y, width, height = box
+        margin = int(height * self.MARGIN) + 1
+        return self.image[max(0, __y - margin):__y + height + margin, max(0, __x - margin):__x + width + margin]
+
+    def read(self, matches: dict, whitelists: dict, params: dict) -> dict:
+        """Reads again the lines of the fields with an alternative binarization, with one OCR call
+        for each distinct whitelist
+
+        Args:
+            matches (dict): function that recognizes the line of each field (i.e.: {field: match})
+            whitelists (dict): characters to restrict the OCR to for each field
+            params (dict): binarization parameters (one of `ALTERNATIVES`)
+
+        Returns:
+            dict: read text of each field that could be located
+        """
+        groups = {}
+        for field, match in matches.items():
+            box = self.locate(match)
+            if box is not None:
+                crop = self.binarize(self._crop(box), deadline=self.deadline, **params)
+                groups.setdefault(whitelists[field], []).append((field, crop))
+
+        read = {}
+        for whitelist, crops in groups.items():
+            texts = MosaicService.read([crop for _, crop in crops], config=f'-c tessedit_char_whitelist={whitelist}',
+                                       deadline=self.deadline)
+            read.update({field: text for (field, _), text in zip(crops, texts)})
+        return read
@@ -0,0 +1,134 @@
+"""
+Service to align photos of fixed layout documents to a template and read their fields directly
+"""
+# pylint: disable=no-member
+import cv2
+import numpy as np
+
+# own dependencies
+from app.services.ocv.ocv_service import OCVService
+
+
+class TemplateService:
+    """
+    A class service to find a fixed layout document in a photo by feature matching against a template,
+    warp it onto the canonical template with a homography and read only the known field regions
+
+    The document service defines the layout with (relative boxes as (x0, y0, x1, y1)):
+        TEMPLATE_FIELDS: boxes of the fields to read, keyed as in `TO_FIND`
+        TEMPLATE_IGNORE: boxes with variable content (i.e.: photos) that are not used for matching
+        WHITELISTS: characters each field can contain
+
+    Public methods:
+        align(img): Warps the document in the image onto the canonical template, None if not found
+        crop(aligned): Crops the field regions of an aligned document
+        read(img, deadline=None): Aligns, crops and reads the fields of the document in the image, None if not found
+        process(img_name, deadline=None): Same as `read` from an image file
+    """
+
+    # ORB features and Lowe's ratio test used to match the template
+    FEATURES = 5000
+    RATIO = 0.75
+    MIN_MATCHES = 15
+
+    # photos are matched on a downscaled copy of at most this size (largest side)
+    MATCH_SIZE = 800
+
+    # width of the canonical template, large enough for the fields text to be read
+    WIDTH = 1100
+
+    def __init__(self, template_name: str, service):
+        """
+        Args:
+            template_name (str): name of the template image file
+            service (BaseDocumentService): document service that defines the layout
+        """
+        template = cv2.imread(template_name)
+        if template is None:
+            raise ValueError(f'Template {template_name} cannot be read.')
+        self.service = service
+
+        # the features of the regions that change from one document to another are not matched
+        gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+        mask = np.full(gray.shape, 255, dtype=np.uint8)
+        for box in list(service.TEMPLATE_FIELDS.values()) + list(service.TEMPLATE_IGNORE):
+            __x0, __y0, __x1, __y1 = self._pixels(box, gray.shape)
+            mask[__y0:__y1, __x0:__x1] = 0
+        self.keypoints, self.descriptors = cv2.ORB_create(self.FEATURES).detectAndCompute(gray, mask)
+
+        scale = self.WIDTH / template.shape[1]
+        self.size = (self.WIDTH, int(round(template.shape[0] * scale)))
+        self.scale = np.diag([scale, scale, 1.])
+
+    @staticmethod
+    def _pixels(box, shape):
+        """Relative box (x0, y0, x1, y1) to pixels in an image of `shape`"""
+        height, width = shape[:2]
+        return int(box[0] * width), int(box[1] * height), int(box[2] * width), int(box[3] * height)
+
+    def _homography(self, gray):
+        """Homography from the image to the canonical template, None if the document is not found"""
+        downscale = min(1., self.MATCH_SIZE / max(gray.shape))
+        gray = cv2.resize(gray, None, fx=downscale, fy=downscale, interpolation=cv2.INTER_AREA)
+
+        # ORB objects are not shared, as they are not thread safe
+        keypoints, descriptors = cv2.ORB_create(self.FEATURES).detectAndCompute(gray, None)
+        if descriptors is None or self.descriptors is None or len(keypoints) < self.MIN_MATCHES:
+            return None
+
+        matches = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(descriptors, self.descriptors, k=2)
+        good = [pair[0] for pair in matches if len(pair) == 2 and pair[0].distance < self.RATIO * pair[1].distance]
+        if len(good) < self.MIN_MATCHES:
+            return None
+
+        source = np.array([keypoints[match.queryIdx].pt for match in good], dtype=np.float32).reshape((-1, 1, 2))
+        target = np.array([self.keypoints[match.trainIdx].pt for match in good], dtype=np.float32).reshape((-1, 1, 2))
+        homography, inliers = cv2.findHomography(source, target, cv2.RANSAC, 5.0)
+        if homography is None or inliers.sum() < self.MIN_MATCHES:
+            return None
+        return self.scale @ homography @ np.diag([downscale, downscale, 1.])
+
+    def align(self, img):
+        """Warps the document in the image onto the canonical template, None if it is not found"""
+        homography = self._homography(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+        if homography is None:
+            return None
+        return cv2.warpPerspective(img, homography, self.size)
+
+    def crop(self, aligned) -> dict:
+        """Crops the field regions of an aligned document. Returns dict of cv2 images"""
+        crops = {}
+        for field, box in self.service.TEMPLATE_FIELDS.items():
+            __x0, __y0, __x1, __y1 = self._pixels(box, aligned.shape)
+            crops[field] = aligned[__y0:__y1, __x0:__x1]
+        return crops
+
+    def read(self, img, deadline=None) -> dict:
+        """Aligns the document, crops its fields and reads them restricted to their characters,
+        with one OCR call for each distinct whitelist
+
+        Args:
+            img (cv2 image): photo of the document
+            deadline (DeadlineService): deadline of the request (None for no deadline)
+
+        Returns:
+            dict: read text of each field (i.e.: {'RUN': 'RUN 1.111.111-1'}), None if the document is not found
+        """
+        aligned = self.align(img)
+        if aligned is None:
+            return None
+
+        groups = {}
+        for field, crop in self.crop(aligned).items():
+            groups.setdefault(self.service.WHITELISTS.get(field, ''), []).append((field, crop))
+
+        fields = {}
+        for whitelist, crops in groups.items():
+            config = f'-c tessedit_char_whitelist={whitelist}' if whitelist else ''
+            texts = OCVService.process_batch([crop for _, crop in crops], config=config, deadline=deadline)
+            fields.update({field: text for (field, _), text in zip(crops, texts)})
+        return fields
+
+    def process(self, img_name: str, deadline=None) -> dict:
+        """Same as `read` from the name of the image file"""
+        return self.read(cv2.imread(img_name), deadline=deadline)
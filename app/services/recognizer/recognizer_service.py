@@ -0,0 +1,140 @@
+"""
+Service to recognize documents in process, the library API behind the Flask API and the batch workers
+"""
+# pylint: disable=no-member
+import cv2
+import numpy as np
+
+# own dependencies
+from app.services.ocv.ocv_service import OCVService
+
+
+class ImageDecodeError(ValueError):
+    """Raised when an uploaded image (or a page of a document) cannot be decoded"""
+
+
+class RecognizerService:
+    """
+    A class service to recognize documents from memory, without multipart encoding, temporary files or
+    JSON in between. It holds the state reused between images (the OCV pipeline, the document services,
+    their templates and tuned profiles) and keeps none of a single recognition, so one instance can be
+    shared by all the threads of a process
+
+    Usage:
+        recognizer = RecognizerService({'cni': CNIService()})
+        result = recognizer.process(open('cni.jpg', 'rb'), 'cni')
+
+    Public methods:
+        service(service_name): Document service of the name, raises KeyError if it is not supported
+        decode(image): cv2 image of bytes, a file-like object or an ndarray
+        parse(service, read, threshold, regions, on_field): Parses what was read with the document service
+        recognize(image, service_name, threshold, deadline, progress): Service result and what was read
+        process(image, service_name, threshold=0.75, deadline=None): Service result, as `process_text` returns it
+    """
+
+    def __init__(self, services: dict, templates=None, profiles=None, workers=1,  # pylint: disable=too-many-arguments
+                 crop=None, strip_height=0):
+        """
+        Args:
+            services (dict): document services by name (i.e.: {'cni': CNIService()})
+            templates (dict): templates of the fixed layout documents by service name (see TemplateService)
+            profiles (dict): binarization parameters by service name (see `app.cli.tune`)
+            workers (int): horizontal bands processed concurrently per image (0 adapts it to the idle cores)
+            crop (CropService): crops the document out of the photo before its whole text is read (None disables it)
+            strip_height (int): rows of the strips to binarize the images by, bounding the peak memory of large
+                                scans (0 binarizes them whole)
+        """
+        self.ocv = OCVService()
+        self.services = services
+        self.templates = templates if templates is not None else {}
+        self.profiles = profiles if profiles is not None else {}
+        self.workers = workers
+        self.crop = crop
+        self.strip_height = strip_height
+
+    def service(self, service_name: str):
+        """Document service of the name
+
+        Raises:
+            KeyError: the service is not supported
+        """
+        if service_name not in self.services:
+            raise KeyError('Invalid service name.')
+        return self.services[service_name]
+
+    @staticmethod
+    def decode(image):
+        """Decodes an image given as bytes (i.e.: the content of a JPEG) or a file-like object opened in
+        binary mode, an ndarray is returned as it is
+
+        Raises:
+            ImageDecodeError: the image cannot be decoded
+        """
+        if isinstance(image, np.ndarray):
+            return image
+        if hasattr(image, 'read'):
+            image = image.read()
+        img = None
+        if isinstance(image, (bytes, bytearray, memoryview)) and len(image):
+            img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ImageDecodeError('Image cannot be decoded.')
+        return img
+
+    @staticmethod
+    def parse(service, read, threshold=0.75, regions=None, on_field=None):
+        """Parses what was read from the image, either its whole text or the fields of its template (which are
+        not searched by their key words, so the threshold does not apply to them)"""
+        if isinstance(read, dict):
+            return service.process_fields(read, on_field=on_field)
+        return service.process_text(read, threshold=threshold, regions=regions, on_field=on_field)
+
+    @staticmethod
+    def _field_progress(progress):
+        """Adapts `progress` to the `on_field` function of the document services, None without progress"""
+        if progress is None:
+            return None
+        return lambda field, value, valid: progress('field', {'field': field, 'value': value, 'valid': valid})
+
+    def recognize(self, image, service_name: str, threshold=0.75, deadline=None,  # pylint: disable=too-many-arguments
+                  progress=None) -> list:
+        """Reads the image, from its template if the service has one or else from its whole text (only of the
+        document cropped out of the photo, if it is found), and parses it with the service
+
+        Args:
+            image (bytes/file/ndarray): image to recognize (see `decode`)
+            service_name (str): name of the document service
+            threshold (int/float): threshold to tolerate the searched terms
+            deadline (DeadlineService): deadline checked between the stages of the processing
+            progress (function): called as `progress(event, data)` as the pipeline advances, with the events
+                                 `binarized`, `read` (with its `source`) and `field` (with its `value` and `valid`)
+
+        Returns:
+            list: service result (dict/None) and what was read (str/dict)
+        """
+        service, img, on_field = self.service(service_name), self.decode(image), self._field_progress(progress)
+        template, result = self.templates.get(service_name), None
+        read = template.read(img, deadline=deadline) if template is not None else None
+        if read is not None:
+            if progress is not None:
+                progress('read', {'source': 'template'})
+            result = self.parse(service, read, on_field=on_field)
+        if result is None:
+            if self.crop is not None:
+                # the background neither is binarized nor reaches the parser as noise lines
+                img = self.crop.crop(img)
+            # keeps the line regions so that a single invalid field is read again from its own line
+            read, regions = self.ocv.read_regions(img, workers=self.workers, deadline=deadline, progress=progress,
+                                                  strip_height=self.strip_height, **self.profiles.get(service_name, {}))
+            if progress is not None:
+                progress('read', {'source': 'ocr'})
+            result = self.parse(service, read, threshold=threshold, regions=regions, on_field=on_field)
+        return [result, read]
+
+    def process(self, image, service_name: str, threshold=0.75, deadline=None):
+        """Recognizes the image with the service (see `recognize`)
+
+        Returns:
+            dict: the fields of the document as the service returns them, None if it is not recognized
+        """
+        return self.recognize(image, service_name, threshold=threshold, deadline=deadline)[0]
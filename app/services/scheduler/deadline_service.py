@@ -0,0 +1,63 @@
+"""
+Service to bound the processing of a request to the time its client is willing to wait
+"""
+import time
+
+
+class DeadlineExceededError(Exception):
+    """Raised when the deadline of a request has passed or its client has disconnected"""
+
+
+class DeadlineService:
+    """
+    A class service with the deadline of a request, checked by the pipeline between its stages and
+    block rows, so that the work of a request that nobody will read is abandoned as soon as possible
+
+    Public methods:
+        remaining(): Seconds until the deadline, None if there is none
+        expired(): Whether the deadline has passed or the client has disconnected
+        check(): Raises DeadlineExceededError if it has expired
+        tesseract(func, image, **kwargs): Runs a pytesseract call bounded by the deadline
+    """
+
+    def __init__(self, timeout=None, cancelled=None):
+        """
+        Args:
+            timeout (int/float): seconds from now to the deadline (None or 0 for no deadline)
+            cancelled (function): returns whether the client has disconnected, checked with the deadline
+        """
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.cancelled = cancelled
+
+    def remaining(self):
+        """Seconds until the deadline (0 if it has passed), None if there is none"""
+        if self.deadline is None:
+            return None
+        return max(0., self.deadline - time.monotonic())
+
+    def expired(self) -> bool:
+        """Whether the deadline has passed or the client has disconnected"""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        return self.cancelled is not None and self.cancelled()
+
+    def check(self):
+        """Raises DeadlineExceededError if the deadline has passed or the client has disconnected"""
+        if self.expired():
+            raise DeadlineExceededError('Deadline exceeded before the image could be processed.')
+
+    def tesseract(self, func, image, **kwargs):
+        """Runs a pytesseract call (i.e.: `pytesseract.image_to_string`) killing it at the deadline
+
+        Raises:
+            DeadlineExceededError: the deadline has passed before or during the call
+        """
+        self.check()
+        remaining = self.remaining()
+        try:
+            # pytesseract takes 0 as no timeout
+            return func(image, timeout=max(remaining, 1e-3) if remaining is not None else 0, **kwargs)
+        except RuntimeError as error:
+            if 'timeout' in str(error).lower():
+                raise DeadlineExceededError('Deadline exceeded while the image was being read.') from error
+            raise
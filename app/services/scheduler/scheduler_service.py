@@ -0,0 +1,171 @@
+"""
+Service to schedule the recognition work fairly between services, priorities and clients
+"""
+import math
+import time
+import heapq
+from collections import deque
+from contextlib import contextmanager
+from itertools import count
+from threading import Condition
+
+# own dependencies
+from app.services.scheduler.deadline_service import DeadlineService
+
+
+class QuotaExceededError(Exception):
+    """Raised when a client already has as many requests in progress as its quota allows"""
+
+
+class SchedulerService:  # pylint: disable=too-many-instance-attributes
+    """
+    A class service that limits the recognition work running at the same time to a number of slots
+    and hands the free slots out with start-time fair queueing: each service gets a share of the slots
+    proportional to its weight, so a flood of requests of one service (i.e.: a bulk import through
+    `/api/basic`) does not make the requests of the others wait behind it. Interactive requests are
+    always dispatched before the batch ones still queued
+
+    It also limits the requests in progress of each client (API key or address) and records the time
+    that the requests of each service waited for their slot and how many of them timed out
+
+    Public methods:
+        admit(client): Context of a request of the client, raises QuotaExceededError over its quota
+        slot(service_name, interactive, deadline): Context that waits for and holds a slot of the service
+        record_timeout(service_name): Counts a request of the service that exceeded its deadline
+        stats(): Wait times, timeouts and queue state of each service
+    """
+
+    # seconds a queued request waits before checking again its own deadline
+    WAIT_SLICE = 0.1
+
+    def __init__(self, slots=1, weights=None, quota=0, quotas=None, window=1000):
+        """
+        Args:
+            slots (int): recognition work running at the same time
+            weights (dict): weight of each service (i.e.: {'cni': 4, 'basic': 1}), 1 if it is not listed
+            quota (int): requests in progress allowed to each client (0 is unlimited)
+            quotas (dict): quota of specific clients (i.e.: {'<api key>': 20})
+            window (int): latest wait times of each service kept to report them
+
+        Raises:
+            ValueError: a weight is not a positive number
+        """
+        for service_name, weight in (weights or {}).items():
+            # the finish tags advance by the inverse of the weights
+            if not 0 < weight < math.inf:
+                raise ValueError(f'Weight of {service_name} must be a positive number, not {weight}.')
+        self.slots = max(1, slots)
+        self.weights = weights or {}
+        self.quota = quota
+        self.quotas = quotas or {}
+        self.window = window
+        self._condition = Condition()
+        self._queue = []
+        self._order = count()
+        self._running = 0
+        # virtual time of the queue and last finish tag of each service
+        self._time = 0.
+        self._finish = {}
+        self._clients = {}
+        self._waits = {}
+        self._timeouts = {}
+
+    @contextmanager
+    def admit(self, client: str):
+        """Context of a request of the client while it is in progress
+
+        Raises:
+            QuotaExceededError: the client already has as many requests in progress as its quota allows
+        """
+        quota = self.quotas.get(client, self.quota)
+        with self._condition:
+            if quota and self._clients.get(client, 0) >= quota:
+                raise QuotaExceededError(f'Client has already {quota} requests in progress.')
+            self._clients[client] = self._clients.get(client, 0) + 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._clients[client] -= 1
+                if not self._clients[client]:
+                    del self._clients[client]
+
+    @contextmanager
+    def slot(self, service_name: str, interactive=True, deadline=None):
+        """Context that waits for a slot of the service and holds it while the work runs
+
+        Args:
+            service_name (str): name of the service, to share the slots according to its weight
+            interactive (bool): whether the request goes before the queued batch requests
+            deadline (DeadlineService): deadline of the request, it leaves the queue once it passes
+
+        Raises:
+            DeadlineExceededError: the deadline has passed before a slot was free
+        """
+        deadline = deadline or DeadlineService()
+        start = time.monotonic()
+        entry = {'granted': False, 'cancelled': False}
+        with self._condition:
+            # start tag of the request, its service advances by the inverse of its weight
+            tag = max(self._time, self._finish.get(service_name, 0.))
+            self._finish[service_name] = tag + 1. / self.weights.get(service_name, 1)
+            heapq.heappush(self._queue, (0 if interactive else 1, tag, next(self._order), entry))
+            self._dispatch()
+            while not entry['granted']:
+                if deadline.expired():
+                    # left in the queue to keep the heap, but skipped when dispatching
+                    entry['cancelled'] = True
+                    deadline.check()
+                # in slices, so that a client that disconnects leaves the queue even without a timeout
+                remaining = deadline.remaining()
+                self._condition.wait(min(self.WAIT_SLICE, remaining) if remaining is not None else self.WAIT_SLICE)
+            self._waits.setdefault(service_name, deque(maxlen=self.window)).append(time.monotonic() - start)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._dispatch()
+
+    def _dispatch(self):
+        """Grants the free slots to the first queued requests (the lock must be held)"""
+        granted = False
+        while self._running < self.slots and self._queue:
+            _, tag, _, entry = heapq.heappop(self._queue)
+            if entry['cancelled']:
+                continue
+            self._time = max(self._time, tag)
+            self._running += 1
+            entry['granted'] = granted = True
+        if granted:
+            self._condition.notify_all()
+
+    def record_timeout(self, service_name: str):
+        """Counts a request of the service that exceeded its deadline"""
+        with self._condition:
+            self._timeouts[service_name] = self._timeouts.get(service_name, 0) + 1
+
+    @staticmethod
+    def _percentile(values: list, percentile: float) -> float:
+        """Percentile of the sorted values (nearest rank)"""
+        return values[min(len(values) - 1, int(percentile * len(values)))]
+
+    def stats(self) -> dict:
+        """Wait times in seconds of the latest requests of each service, their timeouts and the state of the queue
+
+        Returns:
+            dict: i.e.: {'running': 2, 'queued': 5, 'timeouts': {'cni': 1},
+                         'waits': {'cni': {'count': 10, 'p50': 0.1, 'p99': 0.5, 'max': 0.6}}}
+        """
+        with self._condition:
+            waits = {service_name: sorted(values) for service_name, values in self._waits.items()}
+            queued = sum(not entry['cancelled'] for *_, entry in self._queue)
+            stats = {'running': self._running, 'queued': queued, 'timeouts': dict(self._timeouts), 'waits': {}}
+        for service_name, values in waits.items():
+            stats['waits'][service_name] = {
+                'count': len(values),
+                'p50': self._percentile(values, 0.5),
+                'p99': self._percentile(values, 0.99),
+                'max': values[-1]
+            }
+        return stats
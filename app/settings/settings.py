@@ -1,16 +1,90 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # own services
 from app.services.ocv.ocv_service import OCVService
+from app.services.ocv.template_service import TemplateService
+from app.services.ocv.crop_service import CropService
 from app.services.documents.cni_service import CNIService
 from app.services.documents.basic_service import BasicService
+from app.services.cache.text_cache_service import TextCacheService
+from app.services.cache.single_flight_service import SingleFlightService
+from app.services.scheduler.scheduler_service import SchedulerService
+from app.services.capture.capture_service import CaptureService
+from app.services.recognizer.recognizer_service import RecognizerService
 
 load_dotenv(dotenv_path='.env')
 
+
+def pairs(value: str, cast=int) -> dict:
+    """Parses an environment variable of pairs (i.e.: 'cni:4,basic:1' into {'cni': 4, 'basic': 1})"""
+    items = [item.rsplit(':', 1) for item in (value or '').split(',') if ':' in item]
+    return {key.strip(): cast(number) for key, number in items}
+
+
 # config file
 DEBUG = ((os.getenv('DEBUG') or 'False').title() == 'True')
 
+# number of horizontal bands processed concurrently per image by OCV
+# (1 is serial, 0 adapts it to the idle cores)
+OCV_WORKERS = int(os.getenv('OCV_WORKERS') or 1)
+
+# rows of the strips that the images are binarized by, so that the peak memory is proportional to a strip
+# and not to the whole image (0 binarizes them whole)
+OCV_STRIP_HEIGHT = int(os.getenv('OCV_STRIP_HEIGHT') or 0)
+
+# template of the CNI to read its fields directly from their region (i.e.: 'other/img/org.jpg'),
+# the whole image is read if it is not set or the CNI is not found in the photo
+CNI_TEMPLATE = os.getenv('CNI_TEMPLATE')
+
+# whether the document is cropped out of the photo before its whole text is read, so that the background
+# (i.e.: a table or a hand) is not binarized and read too
+DOCUMENT_CROP = ((os.getenv('DOCUMENT_CROP') or 'False').title() == 'True')
+
+# seconds that the read text of each image is kept to be parsed again through `/api/<service>/reparse`
+# (0 disables it)
+OCR_RETENTION = float(os.getenv('OCR_RETENTION') or 300)
+
+# concurrent requests of the same image wait for the first one (up to this many per image), and
+# optionally across the processes of the host through the lock files of a directory
+SINGLE_FLIGHT_WAITERS = int(os.getenv('SINGLE_FLIGHT_WAITERS') or 16)
+SINGLE_FLIGHT_DIR = os.getenv('SINGLE_FLIGHT_DIR') or None
+
+# images processed at the same time (by default one per core), the rest wait in a queue where each
+# service gets a share proportional to its weight (i.e.: 'cni:4,basic:1') and the interactive requests
+# go before the batch ones (sent with the header `X-Priority: batch`)
+SCHEDULER_SLOTS = int(os.getenv('SCHEDULER_SLOTS') or os.cpu_count() or 1)
+SCHEDULER_WEIGHTS = pairs(os.getenv('SCHEDULER_WEIGHTS'), cast=float)
+# requests in progress allowed to each client (`X-API-Key` header or address, 0 is unlimited)
+# and to specific API keys (i.e.: '<api key>:20')
+SCHEDULER_QUOTA = int(os.getenv('SCHEDULER_QUOTA') or 0)
+SCHEDULER_QUOTAS = pairs(os.getenv('SCHEDULER_QUOTAS'))
+
+# seconds that the processing of a request may take before it is abandoned with a 504, unless the
+# request sets its own with the header `X-Timeout` (0 is unlimited)
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT') or 0)
+
+# binarization parameters of each service written by `app.cli.tune` (i.e.: 'profiles.json'),
+# the services without a profile use the defaults of OCVService
+OCV_PROFILE = os.getenv('OCV_PROFILE')
+PROFILES = {}
+if OCV_PROFILE:
+    with open(OCV_PROFILE, encoding='utf-8') as profile:
+        PROFILES = {service_name: tuned['params'] for service_name, tuned in json.load(profile).items()}
+
+# pages of a multi-page document (PDF/TIFF) read concurrently through `/api/<service>/pages`
+PAGE_WORKERS = int(os.getenv('PAGE_WORKERS') or 2)
+
+# the requests slower than `CAPTURE_THRESHOLD` seconds are kept with their stage timings in the ring buffer
+# of `CAPTURE_DIR` (none are captured if it is not set), up to a number of captures and megabytes, encrypted
+# with `CAPTURE_KEY` (a Fernet key, requires cryptography) if it is set, to be replayed by `app.cli.replay`
+CAPTURE_DIR = os.getenv('CAPTURE_DIR') or None
+CAPTURE_THRESHOLD = float(os.getenv('CAPTURE_THRESHOLD') or 2)
+CAPTURE_ENTRIES = int(os.getenv('CAPTURE_ENTRIES') or 100)
+CAPTURE_MB = float(os.getenv('CAPTURE_MB') or 100)
+CAPTURE_KEY = os.getenv('CAPTURE_KEY') or None
+
 config = {
     'UPLOAD_FOLDER': 'app/uploads',
     'ALLOWED_EXTENSIONS': {
@@ -18,12 +92,36 @@ config = {
         'jpg',
         'jpeg'
     },
+    # multi-page documents, only through `/api/<service>/pages` (PDFs require PyMuPDF)
+    'PAGED_EXTENSIONS': {
+        'pdf',
+        'tif',
+        'tiff'
+    },
+    'PAGE_WORKERS': PAGE_WORKERS,
     # !!!IMPORTANT!!!
     #####################################################
     # DO NOT REMOVE OCV, AS IT IS NECESSARY FOR THE REST
     # OF THE SERVICES TO WORK
     'OCV': OCVService(),
     #####################################################
+    'OCV_WORKERS': OCV_WORKERS,
+    # tuned binarization parameters by service
+    'PROFILES': PROFILES,
+    # read text of the images by handle
+    'TEXT_CACHE': TextCacheService(retention=OCR_RETENTION),
+    # coalescing of identical requests in flight
+    'SINGLE_FLIGHT': SingleFlightService(max_waiters=SINGLE_FLIGHT_WAITERS, lock_dir=SINGLE_FLIGHT_DIR),
+    'REQUEST_TIMEOUT': REQUEST_TIMEOUT,
+    # ring buffer of the slow requests
+    'CAPTURE': CaptureService(
+        CAPTURE_DIR, threshold=CAPTURE_THRESHOLD, max_entries=CAPTURE_ENTRIES,
+        max_bytes=int(CAPTURE_MB * 1024 * 1024), key=CAPTURE_KEY
+    ) if CAPTURE_DIR else None,
+    # fair scheduling of the processing between services, priorities and clients
+    'SCHEDULER': SchedulerService(
+        slots=SCHEDULER_SLOTS, weights=SCHEDULER_WEIGHTS, quota=SCHEDULER_QUOTA, quotas=SCHEDULER_QUOTAS
+    ),
 
     # add here the services that are supported
     # the pairs are in form:
@@ -33,5 +131,18 @@ config = {
     'SERVICES': {
         'basic': BasicService(),
         'cni': CNIService()
-    }
+    },
+    # templates of the fixed layout documents, in form:
+    # url: template
+    'TEMPLATES': {}
 }
+
+if CNI_TEMPLATE:
+    config['TEMPLATES']['cni'] = TemplateService(CNI_TEMPLATE, config['SERVICES']['cni'])
+
+# in process recognition with the services, templates and profiles above, shared by the API and the
+# batch workers (and usable as a library)
+config['RECOGNIZER'] = RecognizerService(
+    config['SERVICES'], templates=config['TEMPLATES'], profiles=PROFILES, workers=OCV_WORKERS,
+    crop=CropService() if DOCUMENT_CROP else None, strip_height=OCV_STRIP_HEIGHT
+)
@@ -1,8 +1,16 @@
+import io
+import os
 import json
+import time
+from threading import Event, Thread
 import pytest
+from PIL import Image
+from flask import request
 from app.settings.settings import config
-from app.tests.api.test_app_constants import RUN_DICT
-from app.api.app import app
+from app.services.capture.capture_service import CaptureService
+from app.services.scheduler.scheduler_service import SchedulerService
+from app.tests.api.test_app_constants import RUN_DICT, RUN_TEXT
+from app.api.app import app, extract_deadline, extract_threshold, process_pages
 
 
 @pytest.fixture
@@ -109,3 +117,268 @@ def test_invalid_service_name(client, image_test):
     response = client.post('api/DoesNotAndWillNotExist', data=image_test)
     # checks response
     assert response.status_code == 400
+
+
+def test_reparse_endpoint(client):
+    # what was read by a previous request is parsed again with another threshold or service
+    handle = app.config['TEXT_CACHE'].store(RUN_TEXT)
+
+    response = client.post('api/cni/reparse', data={'handle': handle})
+    assert response.status_code == 200
+    assert response.json['data'] == RUN_DICT
+    assert response.json['handle'] == handle
+
+    response = client.post('api/basic/reparse', data={'handle': handle})
+    assert response.status_code == 200
+    assert type(response.json['data']['interpreted']) is list
+
+    response = client.post('api/cni/reparse', data={'handle': handle, 'threshold': '1'})
+    assert response.status_code == 415
+
+
+def test_reparse_threshold(client):
+    # a key word misread beyond the default threshold ('N0MBRE5') is found with a lower one
+    handle = app.config['TEXT_CACHE'].store(RUN_TEXT.replace('NOMBRE5', 'N0MBRE5'))
+
+    response = client.post('api/cni/reparse', data={'handle': handle})
+    assert response.status_code == 415
+
+    response = client.post('api/cni/reparse', data={'handle': handle, 'threshold': '0.6'})
+    assert response.status_code == 200
+    assert response.json['data'] == RUN_DICT
+
+
+@pytest.mark.parametrize('threshold, expected', [
+    ('0.6', 0.6), ('1', 1.0), ('5', 1.0), ('0', 0.1), ('-1', 0.1), ('nan', 0.75), ('high', 0.75), ('', 0.75)
+])
+def test_extract_threshold(threshold, expected):
+    with app.test_request_context('api/cni', method='POST', data={'threshold': threshold}):
+        assert extract_threshold(request) == expected
+
+
+def test_reparse_invalid_handle(client):
+    response = client.post('api/cni/reparse', data={'handle': 'DoesNotAndWillNotExist'})
+    assert response.status_code == 404
+
+    handle = app.config['TEXT_CACHE'].store('')
+    response = client.post('api/DoesNotAndWillNotExist/reparse', data={'handle': handle})
+    assert response.status_code == 400
+
+
+def test_quota_exceeded(client, image_test):
+    # the client already has as many requests in progress as its quota allows
+    scheduler = app.config['SCHEDULER']
+    scheduler.quotas['DoesNotAndWillNotExist'] = 1
+    try:
+        with scheduler.admit('DoesNotAndWillNotExist'):
+            response = client.post('api/basic', data=image_test, headers={'X-API-Key': 'DoesNotAndWillNotExist'})
+        assert response.status_code == 429
+    finally:
+        del scheduler.quotas['DoesNotAndWillNotExist']
+
+
+def test_stats_endpoint(client):
+    response = client.get('api/stats')
+    assert response.status_code == 200
+    assert type(response.json['scheduler']['waits']) is dict
+
+
+def test_deadline_exceeded(client, image_test):
+    # the request cannot be processed within its own deadline
+    timeouts = app.config['SCHEDULER'].stats()['timeouts'].get('basic', 0)
+    response = client.post('api/basic', data=image_test, headers={'X-Timeout': '0.000001'})
+    assert response.status_code == 504
+    assert app.config['SCHEDULER'].stats()['timeouts']['basic'] == timeouts + 1
+
+
+@pytest.mark.parametrize('timeout, expected', [
+    ('5', 5), ('60', 30), ('inf', 30), ('nan', 30), ('-1', 30), ('0', 30), ('soon', 30), ('', 30)
+])
+def test_extract_deadline(client, monkeypatch, timeout, expected):
+    # the timeout of a request is a positive number of seconds up to the configured one
+    monkeypatch.setitem(app.config, 'REQUEST_TIMEOUT', 30)
+    with app.test_request_context('api/basic', method='POST', headers={'X-Timeout': timeout}):
+        assert extract_deadline(request).remaining() == pytest.approx(expected, abs=1)
+
+
+@pytest.mark.parametrize('timeout', ['inf', 'nan', '-1'])
+def test_invalid_timeout(client, image_test, monkeypatch, timeout):
+    monkeypatch.setattr(config['RECOGNIZER'].ocv, 'read_regions', lambda img, **_: (RUN_TEXT, None))
+    # the request has to wait for the only slot, held for a moment by another one
+    scheduler, held = SchedulerService(slots=1), Event()
+    monkeypatch.setitem(app.config, 'SCHEDULER', scheduler)
+
+    def hold():
+        with scheduler.slot('basic'):
+            held.set()
+            time.sleep(0.2)
+    thread = Thread(target=hold)
+    thread.start()
+    held.wait()
+    response = client.post('api/cni', data=image_test, headers={'X-Timeout': timeout})
+    thread.join()
+    assert response.status_code == 200
+    assert response.json['data'] == RUN_DICT
+
+
+@pytest.fixture
+def document_pages(tmp_path):
+    # multi-page TIFF of the same picture
+    file = os.path.join(str(tmp_path), 'document.tiff')
+    page = Image.open('app/tests/img/run.jpeg')
+    page.save(file, save_all=True, append_images=[page, page])
+    data = {
+        'file': (open(file, 'rb'), 'document.tiff'),
+    }
+    return data
+
+
+def test_pages_endpoint(client, document_pages):
+    response = client.post('api/basic/pages', data=document_pages)
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [line['page'] for line in lines] == [1, 2, 3]
+    assert all(line['status'] == 200 for line in lines)
+
+
+def test_pages_endpoint_stop(client, document_pages):
+    document_pages['stop'] = 'found'
+    response = client.post('api/basic/pages', data=document_pages)
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [line['page'] for line in lines] == [1]
+
+
+def test_pages_endpoint_invalid(client, invalid_file, image_test):
+    response = client.post('api/cni/pages', data=invalid_file)
+    assert response.status_code == 415
+
+    response = client.post('api/DoesNotAndWillNotExist/pages', data=image_test)
+    assert response.status_code == 400
+
+
+def test_pages_endpoint_undecodable(client):
+    # a file named as a TIFF that is not one is unsupported, without the path where it was saved
+    response = client.post('api/cni/pages', data={'file': (io.BytesIO(b'not a tiff'), 'doc.tif')})
+    line = json.loads(response.data.decode().splitlines()[-1])
+    assert line['status'] == 415
+    assert 'uploads' not in line['error']
+
+
+def test_pages_endpoint_unexpected_error(client, document_pages, monkeypatch):
+    def read_regions(img, **_):
+        raise RuntimeError('unexpected')
+    monkeypatch.setattr(config['RECOGNIZER'].ocv, 'read_regions', read_regions)
+    response = client.post('api/basic/pages', data=document_pages)
+    # the stream already started, so the failure is its last line
+    assert json.loads(response.data.decode().splitlines()[-1]) == {'error': 'unexpected', 'status': 500}
+
+
+def test_pages_endpoint_save_error(client, document_pages, monkeypatch):
+    def save_file(file):
+        raise OSError('No space left on device')
+    monkeypatch.setattr('app.api.app.save_file', save_file)
+    scheduler = app.config['SCHEDULER']
+    monkeypatch.setitem(scheduler.quotas, 'DoesNotAndWillNotExist', 1)
+    with app.test_request_context('api/basic/pages', method='POST', data=document_pages,
+                                  headers={'X-API-Key': 'DoesNotAndWillNotExist'}):
+        with pytest.raises(OSError) as error:
+            process_pages(request, 'basic')
+    # the quota of the client was released, not just left to the garbage collection of the failed request
+    # (whose frames are still referenced by the traceback)
+    assert error.traceback
+    with scheduler.admit('DoesNotAndWillNotExist'):
+        pass
+
+
+def server_sent_events(response):
+    events = []
+    for block in response.data.decode().strip().split('\n\n'):
+        event, data = block.split('\n')
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+def test_stream_response_run(client, image_run):
+    response = client.post('api/cni', data=image_run, headers={'Accept': 'text/event-stream'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+
+    events = server_sent_events(response)
+    assert [event for event, _ in events[:3]] == ['accepted', 'binarized', 'read']
+    fields = {data['field']: data for event, data in events if event == 'field'}
+    assert fields['run']['valid']
+    # the final event carries the same payload as the JSON response
+    assert events[-1][0] == 'result'
+    assert events[-1][1]['data'] == RUN_DICT
+
+
+def test_stream_response_deadline(client, image_test):
+    response = client.post('api/basic', data=image_test,
+                           headers={'Accept': 'text/event-stream', 'X-Timeout': '0.000001'})
+    events = server_sent_events(response)
+    assert events[0][0] == 'accepted'
+    assert events[-1] == ('error', {'error': events[-1][1]['error'], 'status': 504})
+
+
+def test_stream_response_invalid(client, invalid_file):
+    response = client.post('api/cni', data=invalid_file, headers={'Accept': 'text/event-stream'})
+    assert response.status_code == 415
+    assert server_sent_events(response)[0][0] == 'error'
+
+
+def test_undecodable_image(client):
+    # an allowed extension whose content is not an image
+    response = client.post('api/cni', data={'file': (io.BytesIO(b'not an image'), 'image.png')})
+    assert response.status_code == 415
+
+    response = client.post('api/cni', data={'file': (io.BytesIO(b'not an image'), 'image.png')},
+                           headers={'Accept': 'text/event-stream'})
+    assert server_sent_events(response)[-1] == ('error', {'error': 'Image cannot be decoded.', 'status': 415})
+
+
+def test_stream_response_unexpected_value_error(client, image_test, monkeypatch):
+    # only the images that cannot be decoded are unsupported, other errors are failures of the processing
+    def read_regions(img, **_):
+        raise ValueError('unexpected')
+    monkeypatch.setattr(config['RECOGNIZER'].ocv, 'read_regions', read_regions)
+    response = client.post('api/cni', data=image_test, headers={'Accept': 'text/event-stream'})
+    assert server_sent_events(response)[-1] == ('error', {'error': 'unexpected', 'status': 500})
+
+
+def test_capture_slow_request(client, image_test, tmp_path, monkeypatch):
+    def read_run(img, **kwargs):
+        kwargs['progress']('binarized')
+        return RUN_TEXT, None
+    monkeypatch.setattr(config['RECOGNIZER'].ocv, 'read_regions', read_run)
+    # every request is slow enough
+    client.application.config['CAPTURE'] = CaptureService(str(tmp_path), threshold=0)
+
+    response = client.post('api/cni', data=image_test)
+    assert response.status_code == 200
+    captures = client.application.config['CAPTURE']
+    capture = captures.load(captures.entries()[0])
+    assert capture['service'] == 'cni'
+    assert list(capture['stages']) == ['scheduled', 'binarized', 'read_ocr', 'parsed']
+    with open('app/tests/img/small.png', 'rb') as image:
+        assert capture['image'] == image.read()
+
+
+def test_capture_timed_out_request(client, image_test, tmp_path):
+    # the requests that time out are captured too, ending with the `error` stage
+    client.application.config['CAPTURE'] = CaptureService(str(tmp_path), threshold=0)
+    response = client.post('api/basic', data=image_test, headers={'X-Timeout': '0.000001'})
+    assert response.status_code == 504
+    captures = client.application.config['CAPTURE']
+    capture = captures.load(captures.entries()[0])
+    assert list(capture['stages'])[-1] == 'error'
+    assert capture['error'].startswith('DeadlineExceededError')
+
+
+def test_capture_failure(client, image_test, tmp_path, monkeypatch):
+    monkeypatch.setattr(config['RECOGNIZER'].ocv, 'read_regions', lambda img, **_: (RUN_TEXT, None))
+    # the captures cannot be stored, but the request does not fail
+    client.application.config['CAPTURE'] = CaptureService(str(tmp_path), threshold=0)
+    os.rmdir(str(tmp_path))
+    response = client.post('api/cni', data=image_test)
+    assert response.status_code == 200
+    assert response.json['data'] == RUN_DICT
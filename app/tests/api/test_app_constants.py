@@ -8,4 +8,12 @@ RUN_DICT = {
     'numero_documento': '102.773.350',
     'fecha_de_emision': '31 JUL 2014',
     'fecha_de_vencimiento': '15 MAR 2020'
-}
\ No newline at end of file
+}
+
+# text as read from 'app/tests/img/run.jpeg', with a misread key word ('NOMBRE5')
+RUN_TEXT = (
+    "CEDULA DE\nIDENTIDAD\n\nRUN 5.632.605-7\n\nREPUBLICA DE CHILE\n\nSERVICIO DE REGISTRO CIVIL E IDENTIFICACION\n\n"
+    "APELLIDOS\nMALDONADO\nJEREZ\n\nNOMBRE5\n\nJUAN DANIEL\n\nNACIONALIDAD SEXO\n\nCHILENA M\n\n"
+    "FECHA DE NACIMIENTO NUMERO DOCUMENTO\n\n15 MAR 1948 102.773.350\n\n"
+    "FECHA DE EMISION FECHA DE VENCIMIENTO\n\n31 JUL 2014 15 MAR 2020\n\nFIRMA DEL TITULAR\n"
+)
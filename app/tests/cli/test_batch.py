@@ -0,0 +1,45 @@
+import json
+from app.cli import batch
+
+
+def test_list_files(tmp_path):
+    for name in ('a.png', 'b.JPG', 'c.strange'):
+        (tmp_path / name).write_bytes(b'')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'd.jpeg').write_bytes(b'')
+
+    files = batch.list_files(str(tmp_path), {'png', 'jpg', 'jpeg'})
+    assert [name.rsplit('/', 1)[-1] for name in files] == ['a.png', 'b.JPG', 'd.jpeg']
+
+    manifest = tmp_path / 'manifest.txt'
+    manifest.write_text('x.png\n\ny.strange\n')
+    assert batch.list_files(str(manifest), {'png'}) == ['x.png']
+
+
+def test_read_checkpoint(tmp_path):
+    checkpoint = tmp_path / 'checkpoint'
+    assert batch.read_checkpoint(str(checkpoint)) == set()
+    checkpoint.write_text('a.png\nb.png\n')
+    assert batch.read_checkpoint(str(checkpoint)) == {'a.png', 'b.png'}
+
+
+def test_process_file_error():
+    batch.init_worker('cni', 0.75, {})
+    record = batch.process_file('DoesNotAndWillNotExist.png')
+    assert record['file'] == 'DoesNotAndWillNotExist.png'
+    assert 'error' in record
+
+
+def test_run_resumes(tmp_path):
+    manifest = tmp_path / 'manifest.txt'
+    manifest.write_text('missing_1.png\nmissing_2.png\n')
+    output = tmp_path / 'results.jsonl'
+    args = batch.parse_args([str(manifest), '--output', str(output), '--processes', '1'])
+
+    assert batch.run(args) == 2
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(record['file'] for record in records) == ['missing_1.png', 'missing_2.png']
+
+    # everything is in the checkpoint, so nothing is processed again
+    assert batch.run(args) == 0
+    assert len(output.read_text().splitlines()) == 2
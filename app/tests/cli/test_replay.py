@@ -0,0 +1,41 @@
+import json
+from app.cli import replay
+from app.settings.settings import config
+from app.services.capture.capture_service import CaptureService, StageTimer
+from app.tests.api.test_app_constants import RUN_TEXT
+
+
+def read_run(img, **kwargs):
+    kwargs['progress']('binarized')
+    return RUN_TEXT, None
+
+
+def test_compare():
+    capture = {'total': 3., 'stages': {'scheduled': 1., 'binarized': 1.5, 'read_ocr': 0.5}}
+    timer = StageTimer()
+    timer.stages = {'binarized': 0.5, 'read_ocr': 0.5, 'parsed': 0.1}
+    comparison = replay.compare(capture, timer)
+    # the wait for a slot is not part of the replayed total
+    assert comparison['captured'] == 2.
+    assert comparison['stages']['binarized'] == {'captured': 1.5, 'replayed': 0.5, 'ratio': 0.333}
+    assert comparison['stages']['scheduled']['replayed'] is None
+    assert comparison['stages']['parsed']['captured'] is None
+
+
+def test_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(config['RECOGNIZER'].ocv, 'read_regions', read_run)
+    captures = CaptureService(str(tmp_path / 'captures'), threshold=0)
+    timer = captures.timer()
+    timer.mark('binarized')
+    with open('app/tests/img/small.png', 'rb') as image:
+        captures.record(image.read(), 'cni', 0.75, timer)
+    captures.record(b'not an image', 'cni', 0.75, timer, error=ValueError('Image cannot be decoded.'))
+
+    output = tmp_path / 'replay.jsonl'
+    args = replay.parse_args([str(tmp_path / 'captures'), '--output', str(output), '--repeat', '2'])
+    records = replay.run(args)
+    assert records == [json.loads(line) for line in output.read_text().splitlines()]
+    assert records[0]['service'] == 'cni'
+    assert set(records[0]['stages']) == {'binarized', 'read_ocr', 'parsed'}
+    assert 'ImageDecodeError' in records[1]['error']
+    assert 'captured_error' not in records[0]
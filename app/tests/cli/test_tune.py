@@ -0,0 +1,59 @@
+import json
+import cv2
+from app.cli import tune
+
+
+def test_load_corpus(tmp_path):
+    for name in ('a.jpg', 'b.jpg', 'c.strange'):
+        (tmp_path / name).write_bytes(b'')
+    (tmp_path / 'a.json').write_text(json.dumps({'RUN': '1.111.111-1'}))
+
+    # only the images with their ground truth
+    corpus = tune.load_corpus(str(tmp_path))
+    assert [(name.rsplit('/', 1)[-1], truth) for name, truth in corpus] == [('a.jpg', {'RUN': '1.111.111-1'})]
+
+
+def test_field_accuracy():
+    truth = {'RUN': '1.111.111-1', 'NOMBRES': 'JUAN', 'SEXO': 'M'}
+    assert tune.field_accuracy({'RUN': '1.111.111-1', 'NOMBRES': 'JUAN', 'SEXO': 'F'}, truth) == (2, 3)
+    assert tune.field_accuracy(None, truth) == (0, 3)
+
+
+def test_rank():
+    fast = {'gamma': 1, 'block_size': 80, 'delta': 50, 'combine_block_size': 20}
+    slow = {'gamma': 1, 'block_size': 40, 'delta': 50, 'combine_block_size': 20}
+    scores = [(fast, 2, 3, 1.), (fast, 2, 3, 1.), (slow, 3, 3, 3.), (slow, 3, 3, 3.)]
+
+    # accuracy is worth more than latency
+    ranking = tune.rank(scores, latency_weight=0.05)
+    assert ranking[0]['params'] == slow
+    assert ranking[0]['accuracy'] == 1
+    assert ranking[0]['latency'] == 3
+
+    # unless latency is expensive
+    assert tune.rank(scores, latency_weight=0.5)[0]['params'] == fast
+
+
+def test_write_profile(tmp_path):
+    output = str(tmp_path / 'profiles.json')
+    tune.write_profile(output, 'cni', {'params': {'gamma': 1}})
+    tune.write_profile(output, 'basic', {'params': {'gamma': 2}})
+    with open(output) as profiles:
+        assert json.load(profiles) == {'cni': {'params': {'gamma': 1}}, 'basic': {'params': {'gamma': 2}}}
+
+
+def test_cached_mask(tmp_path):
+    img_name = 'app/tests/img/small.png'
+    img = cv2.imread(img_name)
+    tune.init_worker('cni', 0.75, str(tmp_path))
+
+    mask, seconds = tune.cached_mask(img_name, img, 1, 40, 50)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # the second time it is read from the cache, with the time it took to compute it
+    cached, cached_seconds = tune.cached_mask(img_name, img, 1, 40, 50)
+    assert (cached == mask).all()
+    assert cached_seconds == seconds
+
+    tune.cached_mask(img_name, img, 1, 80, 50)
+    assert len(list(tmp_path.iterdir())) == 2
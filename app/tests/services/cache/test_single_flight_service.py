@@ -0,0 +1,178 @@
+import os
+import time
+import pytest
+from threading import Barrier, Thread
+from app.services.cache.single_flight_service import SingleFlightService
+from app.services.scheduler.deadline_service import DeadlineService, DeadlineExceededError
+
+
+def run_concurrently(service, key, func, count):
+    results, errors = [], []
+    barrier = Barrier(count)
+
+    def call():
+        barrier.wait()
+        try:
+            results.append(service.do(key, func))
+        except ValueError as error:
+            errors.append(error)
+
+    threads = [Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_key():
+    key = SingleFlightService.key(b'image', 'cni', 0.75)
+    assert key == SingleFlightService.key(b'image', 'cni', 0.75)
+    assert key != SingleFlightService.key(b'image', 'cni', 0.6)
+    assert key != SingleFlightService.key(b'other', 'cni', 0.75)
+
+
+def test_coalesces_concurrent_calls():
+    calls = []
+
+    def func():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'result'
+
+    results, _ = run_concurrently(SingleFlightService(), 'key', func, 5)
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+
+
+def test_max_waiters():
+    calls = []
+
+    def func():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'result'
+
+    results, _ = run_concurrently(SingleFlightService(max_waiters=1), 'key', func, 4)
+    assert results == ['result'] * 4
+    # the leader and its only waiter share a call, the rest run their own
+    assert len(calls) == 3
+
+
+def test_error_propagation():
+    def func():
+        time.sleep(0.2)
+        raise ValueError('unreadable')
+
+    results, errors = run_concurrently(SingleFlightService(), 'key', func, 3)
+    assert results == []
+    assert len(errors) == 3
+
+    # errors are not cached
+    assert SingleFlightService().do('key', lambda: 'result') == 'result'
+
+
+def test_waiter_deadline():
+    service = SingleFlightService()
+    started = Barrier(2)
+
+    def func():
+        started.wait()
+        time.sleep(0.3)
+        return 'result'
+
+    leader = Thread(target=service.do, args=('key', func))
+    leader.start()
+    started.wait()
+    # a waiter stops waiting at its own deadline
+    with pytest.raises(DeadlineExceededError):
+        service.do('key', func, deadline=DeadlineService(timeout=0.05))
+    leader.join()
+
+
+def test_waiter_cancelled():
+    service = SingleFlightService()
+    started, disconnected = Barrier(2), []
+
+    def func():
+        started.wait()
+        time.sleep(0.5)
+        return 'result'
+
+    leader = Thread(target=service.do, args=('key', func))
+    leader.start()
+    started.wait()
+    # a waiter without timeout stops waiting as soon as its client disconnects
+    Thread(target=lambda: (time.sleep(0.05), disconnected.append(True))).start()
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        service.do('key', func, deadline=DeadlineService(cancelled=lambda: bool(disconnected)))
+    assert time.monotonic() - start < 0.4
+    leader.join()
+
+
+def test_leader_disconnected():
+    service = SingleFlightService()
+    started, disconnected, calls, errors = Barrier(2), [], [], []
+
+    def computation(deadline):
+        def func():
+            calls.append(deadline)
+            if len(calls) == 1:
+                started.wait()
+            while len(calls) == 1 and not deadline.expired():
+                time.sleep(0.01)
+            deadline.check()
+            return 'result'
+        return func
+
+    def lead():
+        deadline = DeadlineService(cancelled=lambda: bool(disconnected))
+        try:
+            service.do('key', computation(deadline), deadline=deadline)
+        except DeadlineExceededError as error:
+            errors.append(error)
+
+    leader = Thread(target=lead)
+    leader.start()
+    started.wait()
+    # the client of the leader disconnects while a waiter is attached, which takes the computation over
+    Thread(target=lambda: (time.sleep(0.05), disconnected.append(True))).start()
+    deadline = DeadlineService(timeout=5)
+    assert service.do('key', computation(deadline), deadline=deadline) == 'result'
+    leader.join()
+    assert len(errors) == 1
+    assert calls[1] is deadline
+
+
+def test_lock_dir(tmp_path):
+    # another process (here another instance) reuses the stored result
+    calls = []
+
+    def func():
+        calls.append(1)
+        return ['result', 'text']
+
+    assert SingleFlightService(lock_dir=str(tmp_path)).do('key', func) == ['result', 'text']
+    assert SingleFlightService(lock_dir=str(tmp_path)).do('key', func) == ['result', 'text']
+    assert len(calls) == 1
+
+    # expired results are computed again
+    assert SingleFlightService(lock_dir=str(tmp_path), ttl=0).do('key', func) == ['result', 'text']
+    assert len(calls) == 2
+
+
+def test_lock_dir_retention(tmp_path):
+    # the stored results are removed once they expire, even if no other computation runs
+    service = SingleFlightService(lock_dir=str(tmp_path), ttl=0.2)
+    service.do('key', lambda: ['result', 'text'])
+    assert (tmp_path / 'key.json').exists()
+    assert oct((tmp_path / 'key.json').stat().st_mode & 0o777) == oct(0o600)
+    time.sleep(0.5)
+    assert not (tmp_path / 'key.json').exists()
+
+    # and the ones left by a process that ended are removed when another one starts
+    (tmp_path / 'left.json').write_text('["result", "text"]')
+    os.utime(str(tmp_path / 'left.json'), (0, 0))
+    SingleFlightService(lock_dir=str(tmp_path), ttl=0.2)
+    assert not (tmp_path / 'left.json').exists()
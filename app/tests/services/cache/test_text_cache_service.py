@@ -0,0 +1,30 @@
+import time
+from app.services.cache.text_cache_service import TextCacheService
+
+
+def test_store_and_get():
+    cache = TextCacheService(retention=60)
+    handle = cache.store('RUN 1.111.111-1')
+    assert type(handle) is str
+    assert cache.get(handle) == 'RUN 1.111.111-1'
+    assert cache.get('DoesNotAndWillNotExist') is None
+    assert cache.get(None) is None
+
+
+def test_expiration():
+    cache = TextCacheService(retention=0.01)
+    handle = cache.store('text')
+    time.sleep(0.02)
+    assert cache.get(handle) is None
+
+
+def test_max_entries():
+    cache = TextCacheService(retention=60, max_entries=2)
+    handles = [cache.store(str(i)) for i in range(3)]
+    # the oldest is dropped
+    assert cache.get(handles[0]) is None
+    assert [cache.get(handle) for handle in handles[1:]] == ['1', '2']
+
+
+def test_disabled():
+    assert TextCacheService(retention=0).store('text') is None
@@ -0,0 +1,82 @@
+import os
+import pytest
+from app.services.capture import capture_service
+from app.services.capture.capture_service import CaptureService, StageTimer
+
+
+def test_stage_timer():
+    timer = StageTimer()
+    timer.mark('scheduled')
+    timer.progress('binarized')
+    timer.progress('field', {'field': 'run', 'value': '1', 'valid': True})
+    timer.progress('read', {'source': 'ocr'})
+    assert list(timer.stages) == ['scheduled', 'binarized', 'read_ocr']
+    assert timer.total() == pytest.approx(sum(timer.stages.values()))
+
+
+def test_record_and_load(tmp_path):
+    captures = CaptureService(str(tmp_path), threshold=0)
+    timer = captures.timer()
+    timer.mark('binarized')
+    path = captures.record(b'image', 'cni', 0.75, timer)
+    assert captures.entries() == [path]
+
+    capture = captures.load(path)
+    assert capture['image'] == b'image'
+    assert capture['service'] == 'cni'
+    assert capture['threshold'] == 0.75
+    assert capture['stages'] == timer.stages
+
+
+def test_record_error(tmp_path):
+    captures = CaptureService(str(tmp_path), threshold=0)
+    timer = captures.timer()
+    timer.mark('error')
+    path = captures.record(b'image', 'cni', 0.75, timer, error=TimeoutError('too slow'))
+    assert captures.load(path)['error'] == 'TimeoutError: too slow'
+
+
+def test_record_failure(tmp_path, monkeypatch, caplog):
+    # a capture that cannot be stored is logged and nothing is left behind
+    def replace(source, target):
+        raise OSError('No space left on device')
+    monkeypatch.setattr(capture_service.os, 'replace', replace)
+    captures = CaptureService(str(tmp_path), threshold=0)
+    assert captures.record(b'image', 'cni', 0.75, captures.timer()) is None
+    assert 'could not be captured' in caplog.text
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_record_fast(tmp_path):
+    captures = CaptureService(str(tmp_path), threshold=60)
+    assert captures.record(b'image', 'cni', 0.75, captures.timer()) is None
+    assert captures.entries() == []
+
+
+def test_ring_buffer(tmp_path):
+    captures = CaptureService(str(tmp_path), threshold=0, max_entries=2)
+    paths = [captures.record(str(i).encode(), 'cni', 0.75, captures.timer()) for i in range(3)]
+    # the oldest is dropped
+    assert captures.entries() == paths[1:]
+
+    captures = CaptureService(str(tmp_path / 'size'), threshold=0, max_bytes=1500)
+    paths = [captures.record(b'x' * 300, 'cni', 0.75, captures.timer()) for _ in range(3)]
+    assert captures.entries() == paths[1:]
+    assert sum(os.path.getsize(path) for path in captures.entries()) <= 1500
+
+
+def test_encrypted(tmp_path):
+    fernet = pytest.importorskip('cryptography.fernet')
+    key = fernet.Fernet.generate_key()
+    captures = CaptureService(str(tmp_path), threshold=0, key=key)
+    path = captures.record(b'image', 'cni', 0.75, captures.timer())
+    with open(path, 'rb') as stored:
+        assert b'cni' not in stored.read()
+    assert captures.load(path)['image'] == b'image'
+
+
+def test_encrypted_unavailable(tmp_path):
+    if capture_service.Fernet is not None:
+        pytest.skip('cryptography is installed')
+    with pytest.raises(ValueError):
+        CaptureService(str(tmp_path), key='key')
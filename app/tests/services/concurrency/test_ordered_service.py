@@ -0,0 +1,43 @@
+import time
+import unittest
+from app.services.concurrency.ordered_service import OrderedService
+
+
+class OrderedServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = OrderedService()
+
+    def tearDown(self):
+        del self.service
+
+    def test_process_order(self):
+        # results are yielded in order even if later items finish first
+        def func(item):
+            time.sleep(0.01 * item)
+            return item * 2
+        self.assertEqual(list(self.service.process(iter([3, 2, 1, 0]), func, workers=3)), [6, 4, 2, 0])
+
+    def test_process_lazy(self):
+        # items are only taken when a worker is free, and closing stops taking them
+        taken = []
+
+        def items():
+            for item in range(100):
+                taken.append(item)
+                yield item
+
+        results = self.service.process(items(), lambda item: item, workers=2)
+        self.assertEqual(next(results), 0)
+        results.close()
+        self.assertLessEqual(len(taken), 3)
+
+    def test_process_error(self):
+        def func(item):
+            if item == 1:
+                raise ValueError('unreadable')
+            return item
+
+        results = self.service.process(iter([0, 1, 2]), func)
+        self.assertEqual(next(results), 0)
+        self.assertRaises(ValueError, next, results)
@@ -90,3 +90,94 @@ def test__clean_processed_text_return_type():
 
 def test_valid_text_return_type():
     assert type(cni_service.valid_text('')) == bool
+
+
+class FakeRegions:
+    # alternative readings of the lines, returned in order
+    ALTERNATIVES = [{'attempt': 0}, {'attempt': 1}, {'attempt': 2}]
+
+    def __init__(self, readings):
+        self.readings = readings
+        self.calls = 0
+
+    def read(self, matches, whitelists, params):
+        self.calls += 1
+        return {field: self.readings[params['attempt']] for field in matches}
+
+
+def test_process_text_retries_invalid_field():
+    # due date is misread, so the field is read again from its line until it is valid
+    text = valid_run[0].replace('31 JUL 2014 15 MAR 2020', '31 JUL 2O14 15 MAR 2O2O')
+    assert cni_service.process_text(text) is None
+
+    regions = FakeRegions(['31 JUL 2O14', '31 JUL 2014 15 MAR 2020', '01 ENE 2000 01 ENE 2010'])
+    result = cni_service.process_text(text, regions=regions)
+    assert result['fecha_de_emision'] == '31 JUL 2014'
+    assert result['fecha_de_vencimiento'] == '15 MAR 2020'
+    # stops as soon as the field is valid
+    assert regions.calls == 2
+
+
+def test_process_text_retry_not_valid():
+    text = valid_run[0].replace('31 JUL 2014 15 MAR 2020', '31 JUL 2O14 15 MAR 2O2O')
+    assert cni_service.process_text(text, regions=FakeRegions(['', 'JUL', '2014'])) is None
+
+
+def test_whitelists_spanish_letters():
+    # a name read on its own keeps its Spanish letters
+    for field in ('APELLIDOS', 'NOMBRES', 'NACIONALIDAD SEXO'):
+        assert set('MUÑOZ JOSÉ ÁLVAREZ ÍÑIGO ÓSCAR ÚRSULA'.replace(' ', '')) <= set(cni_service.WHITELISTS[field])
+    assert 'Ñ' not in cni_service.WHITELISTS['RUN']
+
+
+@pytest.mark.parametrize("test_input", valid_run)
+def test_process_text_low_threshold(test_input):
+    # 'NACIONALIDAD' also matches the 'NACIONALIDAD SEXO' key word, the nationality is still the one read
+    result = cni_service.process_text(test_input, threshold=0.6)
+    assert result['nacionalidad'] == 'CHILENA'
+    assert result['sexo'] == 'M'
+
+
+def test__invalid_fields_return_type():
+    invalid = cni_service._invalid_fields({key: None for key in cni_service.TO_FIND.keys()})
+    assert type(invalid) == list
+    assert 'RUN' in invalid
+
+
+def test_process_fields():
+    fields = {
+        'RUN': 'RUN 5.632.605-7\n',
+        'APELLIDOS': 'MALDONADO\nJEREZ\n',
+        'NOMBRES': 'JUAN DANIEL',
+        'NACIONALIDAD SEXO': 'CHILENA M',
+        'FECHA DE NACIMIENTO NUMERO DOCUMENTO': '15 MAR 1948 102.773.350',
+        'FECHA DE EMISION FECHA DE VENCIMIENTO': '31 JUL 2014 15 MAR 2020'
+    }
+    result = cni_service.process_fields(fields)
+    assert result['run'] == '5.632.605-7'
+    assert result['apellidos'] == 'MALDONADO JEREZ'
+    assert result['sexo'] == 'M'
+    assert result['fecha_de_vencimiento'] == '15 MAR 2020'
+
+    # invalid fields
+    assert cni_service.process_fields(dict(fields, RUN='')) is None
+
+
+def test_process_text_on_field():
+    # each field is reported as soon as it is associated, and again when a retry fixes it
+    text = valid_run[0].replace('31 JUL 2014 15 MAR 2020', '31 JUL 2O14 15 MAR 2O2O')
+    reported = []
+    regions = FakeRegions(['31 JUL 2O14', '31 JUL 2014 15 MAR 2020', ''])
+    cni_service.process_text(text, regions=regions, on_field=lambda *field: reported.append(field))
+
+    assert ('run', 'RUN 5.632.605-7', True) in reported
+    assert reported.index(('fecha_de_emision_fecha_de_vencimiento', '31 JUL 2O14 15 MAR 2O2O', False)) < \
+        reported.index(('fecha_de_emision_fecha_de_vencimiento', '31 JUL 2014 15 MAR 2020', True))
+    # unchanged fields are reported once
+    assert len([field for field in reported if field[0] == 'run']) == 1
+
+
+def test_process_fields_on_field():
+    reported = []
+    cni_service.process_fields({'RUN': 'RUN 5.632.605-7', 'NOMBRES': ''}, on_field=lambda *field: reported.append(field))
+    assert reported == [('run', 'RUN 5.632.605-7', True)]
@@ -0,0 +1,69 @@
+import numpy as np
+import cv2
+import unittest
+from app.cli.synthetic import generate
+from app.services.ocv.crop_service import CropService
+
+
+class CropServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        # a card in perspective on a striped table
+        self.photo = np.full((900, 1200, 3), 60, dtype=np.uint8)
+        self.photo[::7] = 90
+        self.corners = np.array([[300, 200], [900, 260], [860, 640], [260, 600]])
+        cv2.fillConvexPoly(self.photo, self.corners.astype(np.int32), (235, 235, 235))
+        cv2.putText(self.photo, 'RUN 1.111.111-1', (350, 420), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (20, 20, 20), 3)
+        self.service = CropService()
+
+    def tearDown(self):
+        del self.service
+        del self.photo
+
+    def test_find(self):
+        corners = self.service.find(self.photo)
+        self.assertEqual(corners.shape, (4, 2))
+        # found on the downscaled copy, so only a few pixels away
+        self.assertLess(np.abs(corners - self.corners).max(), 10)
+
+    def test_find_none(self):
+        self.assertIsNone(self.service.find(np.full((400, 600, 3), 128, dtype=np.uint8)))
+        # the whole photo is not a document
+        self.assertIsNone(self.service.find(cv2.imread('app/tests/img/run.jpeg')))
+
+    def test_crop(self):
+        cropped = self.service.crop(self.photo)
+        # only the card, upright
+        self.assertLess(cropped.size, self.photo.size / 2)
+        self.assertGreater(cropped.shape[1], cropped.shape[0])
+        self.assertGreater(cropped[5:-5, 5:-5].mean(), 200)
+
+    def test_find_card_filling_the_photo(self):
+        # the card has no outline to find, its portrait (an inner rectangle) is not taken for it
+        for index in range(3):
+            img, _ = generate(index, clean=True)
+            self.assertIsNone(self.service.find(img))
+            self.assertIs(self.service.crop(img), img)
+
+    def test_crop_never_portrait(self):
+        # degraded photos: either the whole card or the whole photo, never only a part of the card
+        for index in (0, 4):
+            img, _ = generate(index)
+            cropped = self.service.crop(img)
+            self.assertGreater(cropped.shape[1] / cropped.shape[0], 1.3)
+            self.assertGreater(cropped.shape[0] * cropped.shape[1], img.shape[0] * img.shape[1] / 3)
+
+    def test_find_aspect(self):
+        # a square is not an ID card
+        square = np.full((900, 1200, 3), 60, dtype=np.uint8)
+        cv2.rectangle(square, (300, 150), (900, 750), (235, 235, 235), -1)
+        self.assertIsNone(self.service.find(square))
+
+    def test_crop_fallback(self):
+        blank = np.full((400, 600, 3), 128, dtype=np.uint8)
+        self.assertIs(self.service.crop(blank), blank)
+
+    def test_warp_max_size(self):
+        corners = np.array([[0, 0], [3999, 0], [3999, 1999], [0, 1999]], dtype=np.float32)
+        warped = self.service.warp(np.zeros((2000, 4000, 3), dtype=np.uint8), corners)
+        self.assertEqual(warped.shape[:2], (800, CropService.MAX_SIZE))
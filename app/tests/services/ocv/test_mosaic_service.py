@@ -0,0 +1,55 @@
+import numpy as np
+import cv2
+import unittest
+from app.services.ocv.mosaic_service import MosaicService
+
+
+class MosaicServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        img = cv2.imread('app/tests/img/small.png')
+        self.crops = [img, img[:40, :90], img[:10, :10], cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)]
+        self.service = MosaicService()
+
+    def tearDown(self):
+        del self.service
+        del self.crops
+
+    def test_pack_return_type(self):
+        mosaic, boxes = self.service.pack(self.crops)
+        self.assertTrue(type(mosaic) is np.ndarray)
+        self.assertEqual(mosaic.ndim, 2)
+        self.assertEqual(len(boxes), len(self.crops))
+
+    def test_pack_places_crops(self):
+        mosaic, boxes = self.service.pack(self.crops, padding=8, max_width=300)
+        for crop, (x, y, w, h) in zip(self.crops, boxes):
+            self.assertEqual((h, w), crop.shape[:2])
+            self.assertTrue((mosaic[y:y + h, x:x + w] == MosaicService._gray(crop)).all())
+
+        # boxes must not overlap
+        for i, (x, y, w, h) in enumerate(boxes):
+            for (x2, y2, w2, h2) in boxes[i + 1:]:
+                self.assertTrue(x + w <= x2 or x2 + w2 <= x or y + h <= y2 or y2 + h2 <= y)
+
+    def test_pack_wide_crop(self):
+        # a crop wider than the mosaic widens it
+        mosaic, _ = self.service.pack([np.zeros((5, 500), np.uint8)], padding=4, max_width=100)
+        self.assertEqual(mosaic.shape[1], 508)
+
+    def test_assign(self):
+        boxes = [(0, 0, 100, 50), (120, 0, 100, 50)]
+        data = {
+            'text': ['RUN', '12.345.678-9', '', 'JUAN', 'PEREZ', 'SOTO', 'lost'],
+            'left': [5, 40, 0, 125, 170, 125, 105],
+            'top': [5, 5, 0, 5, 5, 30, 5],
+            'width': [30, 50, 0, 40, 40, 40, 10],
+            'height': [10, 10, 0, 10, 10, 10, 10],
+            'block_num': [1, 1, 1, 1, 1, 1, 1],
+            'par_num': [1, 1, 1, 1, 1, 1, 1],
+            'line_num': [1, 1, 1, 1, 1, 2, 1],
+        }
+        self.assertEqual(self.service.assign(data, boxes), ['RUN 12.345.678-9', 'JUAN PEREZ\nSOTO'])
+
+    def test_read_empty(self):
+        self.assertEqual(self.service.read([]), [])
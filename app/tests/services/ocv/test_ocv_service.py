@@ -2,6 +2,7 @@ from numpy import ndarray
 import cv2
 import unittest
 from app.services.ocv.ocv_service import OCVService
+from app.services.scheduler.deadline_service import DeadlineService, DeadlineExceededError
 
 
 class OCVServiceTest(unittest.TestCase):
@@ -62,6 +63,74 @@ class OCVServiceTest(unittest.TestCase):
         # delta must be float or integer
         self.assertRaises(TypeError, self.service.process_image, self.img, delta='')
 
+    def test_process_image_workers(self):
+        # banded processing must be identical to the serial one
+        img = cv2.imread('app/tests/img/run_unclear.jpeg')
+        serial = self.service.process_image(img, block_size=80, delta=50)
+        for workers in (2, 3, 0):
+            banded = self.service.process_image(img, block_size=80, delta=50, workers=workers)
+            self.assertTrue((serial == banded).all())
+
+        # workers must be an integer
+        self.assertRaises(TypeError, self.service.process_image, self.img, workers=1.5)
+
+    def test_combine_process_workers(self):
+        # banded processing must be identical to the serial one
+        img = cv2.imread('app/tests/img/run_unclear.jpeg')
+        mask = self.service.process_image(img)
+        serial = self.service.combine_process(img, mask)
+        for workers in (2, 3, 0):
+            self.assertTrue((serial == self.service.combine_process(img, mask, workers=workers)).all())
+
+    def test_process_image_deadline(self):
+        # the work is abandoned once the deadline passes, even if it is banded
+        deadline = DeadlineService(cancelled=lambda: True)
+        for workers in (1, 2):
+            self.assertRaises(DeadlineExceededError, self.service.process_image, self.img,
+                              workers=workers, deadline=deadline)
+            self.assertRaises(DeadlineExceededError, self.service.binarize, self.img,
+                              workers=workers, deadline=deadline)
+
+        # a deadline not reached yet does not change the result
+        serial = self.service.binarize(self.img)
+        self.assertTrue((serial == self.service.binarize(self.img, deadline=DeadlineService(timeout=60))).all())
+
+    def test_combine_process_block_size(self):
+        mask = self.service.process_image(self.img)
+        default = self.service.combine_process(self.img, mask)
+        self.assertTrue((default == self.service.combine_process(self.img, mask, block_size=20)).all())
+        self.assertTrue((default == self.service.binarize(self.img, combine_block_size=20)).all())
+        self.assertEqual(self.service.binarize(self.img, combine_block_size=40).shape, default.shape)
+
+        # block size must be a positive integer
+        self.assertRaises(ValueError, self.service.combine_process, self.img, mask, block_size=0)
+        self.assertRaises(TypeError, self.service.binarize, self.img, combine_block_size=1.5)
+
+    def test_binarize_strips(self):
+        # a larger image, so that it spans many strips and blocks
+        img = cv2.resize(cv2.imread('app/tests/img/run.jpeg'), None, fx=0.2, fy=0.2)
+        whole = self.service.binarize(img, block_size=40, combine_block_size=10)
+        for strip_height, workers in ((1, 1), (37, 2), (100, 0), (10000, 1)):
+            strips = self.service.binarize(img, block_size=40, combine_block_size=10, strip_height=strip_height,
+                                           workers=workers)
+            self.assertEqual(strips.dtype, whole.dtype)
+            self.assertTrue((strips == whole).all())
+
+        # the strips are yielded in order, each one with its top row
+        tops = [top for top, _ in self.service.binarize_strips(img, strip_height=50)]
+        self.assertEqual(tops, list(range(0, img.shape[0], 50)))
+
+        # strip height must be a positive integer (0 only in `binarize`, which binarizes it whole)
+        self.assertRaises(ValueError, self.service.binarize_strips, self.img, strip_height=0)
+        self.assertRaises(ValueError, self.service.binarize, self.img, strip_height=-1)
+        self.assertRaises(TypeError, self.service.binarize, self.img, strip_height=1.5)
+
+    def test_binarize_strips_deadline(self):
+        deadline = DeadlineService(cancelled=lambda: True)
+        for workers in (1, 2):
+            self.assertRaises(DeadlineExceededError, self.service.binarize, self.img, strip_height=20,
+                              workers=workers, deadline=deadline)
+
     def test_combine_process_return_type(self):
         mask = self.service.adjust_gamma(self.img)
         mask = self.service.process_image(mask)
@@ -76,6 +145,23 @@ class OCVServiceTest(unittest.TestCase):
         # mask type must be ndarray
         self.assertRaises(TypeError, self.service.combine_process, self.img, '')
 
+    def test__data_lines(self):
+        data = {
+            'text': ['', 'RUN', '5.632.605-7', 'APELLIDOS', ' ', 'MALDONADO'],
+            'left': [0, 10, 60, 10, 0, 10],
+            'top': [0, 10, 8, 50, 0, 80],
+            'width': [0, 40, 90, 100, 0, 110],
+            'height': [0, 20, 24, 20, 0, 20],
+            'block_num': [1, 1, 1, 2, 2, 2],
+            'par_num': [1, 1, 1, 1, 1, 1],
+            'line_num': [1, 1, 1, 1, 1, 2],
+        }
+        text, lines = self.service._data_lines(data)
+        # paragraphs are separated by an empty line
+        self.assertEqual(text, 'RUN 5.632.605-7\n\nAPELLIDOS\nMALDONADO\n')
+        self.assertEqual(lines, [('RUN 5.632.605-7', (10, 8, 140, 24)), ('APELLIDOS', (10, 50, 100, 20)),
+                                 ('MALDONADO', (10, 80, 110, 20))])
+
     def test_process_return_type(self):
         # must return correct type
         self.assertTrue(type(self.service.process(self.img_dir)) is str)
@@ -112,4 +198,14 @@ class OCVServiceTest(unittest.TestCase):
         self.assertRaises(ValueError, self.service.adjust_gamma, self.img, gamma=-2.1)
 
         # gamma can be float or int and nothing else
-        self.assertRaises(TypeError, self.service.adjust_gamma, self.img, gamma='1')
\ No newline at end of file
+        self.assertRaises(TypeError, self.service.adjust_gamma, self.img, gamma='1')
+
+    def test_process_batch_return_type(self):
+        # must return one string per image
+        result = self.service.process_batch([self.img, self.img[:64, :64]])
+        self.assertTrue(type(result) is list)
+        self.assertEqual(len(result), 2)
+        self.assertTrue(all(type(text) is str for text in result))
+
+        # images must be a list
+        self.assertRaises(TypeError, self.service.process_batch, images=self.img)
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import cv2
+import numpy as np
+from PIL import Image
+from app.services.ocv.page_service import PageService, fitz
+from app.services.recognizer.recognizer_service import ImageDecodeError
+
+
+class PageServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.img = cv2.imread('app/tests/img/small.png')
+        self.dir = tempfile.TemporaryDirectory()
+        # multi-page TIFF whose pages have different sizes
+        self.tiff = os.path.join(self.dir.name, 'document.tiff')
+        frames = [Image.fromarray(cv2.cvtColor(self.img[:size, :size], cv2.COLOR_BGR2RGB)) for size in (128, 64, 32)]
+        frames[0].save(self.tiff, save_all=True, append_images=frames[1:])
+        self.service = PageService()
+
+    def tearDown(self):
+        self.dir.cleanup()
+        del self.service
+        del self.img
+
+    def test_pages_tiff(self):
+        pages = list(self.service.pages(self.tiff, 'TIFF'))
+        self.assertEqual([page.shape for page in pages], [(128, 128, 3), (64, 64, 3), (32, 32, 3)])
+        self.assertTrue((pages[1] == self.img[:64, :64]).all())
+
+    def test_pages_image(self):
+        pages = list(self.service.pages('app/tests/img/small.png', 'png'))
+        self.assertEqual(len(pages), 1)
+        self.assertTrue((pages[0] == self.img).all())
+
+        # files that cannot be decoded
+        self.assertRaises(ImageDecodeError, list, self.service.pages('app/tests/img/file.strange', 'png'))
+
+    @unittest.skipIf(fitz is None, 'PyMuPDF is not installed')
+    def test_pages_pdf(self):
+        pdf = os.path.join(self.dir.name, 'document.pdf')
+        with fitz.open() as document:
+            for _ in range(2):
+                document.new_page()
+            document.save(pdf)
+        pages = list(self.service.pages(pdf, 'pdf'))
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(pages[0].ndim, 3)
+
+    def test_pages_pdf_channels(self):
+        # rendered pages are converted to BGR according to their channels (gray, RGB or RGB with alpha)
+        def pixmap(channels):
+            pixels = np.full((2, 3, channels), 200, dtype=np.uint8)
+            return SimpleNamespace(samples=pixels.tobytes(), n=channels, height=2, width=3)
+
+        pages = [SimpleNamespace(get_pixmap=lambda dpi, channels=channels: pixmap(channels)) for channels in (1, 3, 4)]
+        document = mock.MagicMock()
+        document.__iter__.side_effect = lambda: iter(pages)
+        with mock.patch('app.services.ocv.page_service.fitz', SimpleNamespace(open=lambda path, **_: document)):
+            converted = list(self.service.pages('document.pdf', 'pdf'))
+            self.assertEqual([page.shape for page in converted], [(2, 3, 3)] * 3)
+            self.assertTrue(all((page == 200).all() for page in converted))
+
+            pages[0] = SimpleNamespace(get_pixmap=lambda dpi: pixmap(2))
+            self.assertRaises(ImageDecodeError, list, self.service.pages('document.pdf', 'pdf'))
+
+    def test_pages_tiff_invalid(self):
+        # not a TIFF, the error does not tell the path of the file
+        path = os.path.join(self.dir.name, 'upload')
+        with open(path, 'wb') as upload:
+            upload.write(b'not a tiff')
+        with self.assertRaises(ImageDecodeError) as error:
+            list(self.service.pages(path, 'tif'))
+        self.assertNotIn(path, str(error.exception))
+
+    def test_pages_pdf_invalid(self):
+        def open_pdf(path, **_):
+            raise RuntimeError(f"cannot open broken document '{path}'")
+        with mock.patch('app.services.ocv.page_service.fitz', SimpleNamespace(open=open_pdf)):
+            with self.assertRaises(ImageDecodeError) as error:
+                list(self.service.pages('app/uploads/upload', 'pdf'))
+            self.assertNotIn('app/uploads', str(error.exception))
+
+        page = SimpleNamespace(get_pixmap=mock.Mock(side_effect=RuntimeError('broken page')))
+        document = mock.MagicMock()
+        document.__iter__.side_effect = lambda: iter([page])
+        with mock.patch('app.services.ocv.page_service.fitz', SimpleNamespace(open=lambda path, **_: document)):
+            self.assertRaises(ImageDecodeError, list, self.service.pages('app/uploads/upload', 'pdf'))
@@ -0,0 +1,31 @@
+import numpy as np
+import unittest
+from app.services.ocv.ocv_service import OCVService
+from app.services.ocv.region_service import RegionService
+
+
+class RegionServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.img = np.zeros((100, 200, 3), np.uint8)
+        self.lines = [('RUN 5.632.605-7', (10, 10, 120, 20)), ('31 JUL 2014 15 MAR 2020', (10, 60, 150, 20))]
+        self.service = RegionService(self.img, self.lines, OCVService.binarize)
+
+    def tearDown(self):
+        del self.service
+        del self.lines
+        del self.img
+
+    def test_locate(self):
+        self.assertEqual(self.service.locate(lambda line: 'JUL' in line), (10, 60, 150, 20))
+        self.assertIsNone(self.service.locate(lambda line: 'NOT' in line))
+
+    def test_crop_margin(self):
+        # crops are clipped to the image
+        self.assertEqual(self.service._crop((10, 10, 120, 20)).shape, (34, 134, 3))
+        self.assertEqual(self.service._crop((0, 90, 200, 10)).shape, (14, 200, 3))
+
+    def test_read_unlocated(self):
+        # lines that cannot be located are not read
+        self.assertEqual(self.service.read({'X': lambda line: False}, {'X': '0'}, {}), {})
+
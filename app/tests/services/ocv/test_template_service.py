@@ -0,0 +1,31 @@
+import cv2
+import unittest
+from app.services.documents.cni_service import CNIService
+from app.services.ocv.template_service import TemplateService
+
+
+class TemplateServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = TemplateService('other/img/org.jpg', CNIService())
+
+    def tearDown(self):
+        del self.service
+
+    def test_invalid_template(self):
+        self.assertRaises(ValueError, TemplateService, 'app/tests/img/file.strange', CNIService())
+
+    def test_align(self):
+        # a photo of a different CNI is warped onto the canonical template
+        aligned = self.service.align(cv2.imread('app/tests/img/run.jpeg'))
+        self.assertEqual(aligned.shape[:2], (self.service.size[1], self.service.size[0]))
+
+        # no CNI to be found
+        self.assertIsNone(self.service.align(cv2.imread('app/tests/img/small.png')))
+        self.assertIsNone(self.service.read(cv2.imread('app/tests/img/small.png')))
+
+    def test_crop(self):
+        aligned = self.service.align(cv2.imread('app/tests/img/run.jpeg'))
+        crops = self.service.crop(aligned)
+        self.assertEqual(sorted(crops.keys()), sorted(CNIService.TEMPLATE_FIELDS.keys()))
+        self.assertTrue(all(crop.size > 0 for crop in crops.values()))
@@ -0,0 +1,92 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import pytest
+from app.services.documents.basic_service import BasicService
+from app.services.documents.cni_service import CNIService
+from app.services.ocv.crop_service import CropService
+from app.services.recognizer.recognizer_service import ImageDecodeError, RecognizerService
+from app.tests.api.test_app_constants import RUN_DICT, RUN_TEXT
+
+
+IMAGE = 'app/tests/img/small.png'
+
+
+@pytest.fixture
+def recognizer():
+    return RecognizerService({'basic': BasicService(), 'cni': CNIService()})
+
+
+def read_run(img, **_):
+    # what the OCR reads from a CNI, without its line regions
+    return RUN_TEXT, None
+
+
+def test_decode():
+    with open(IMAGE, 'rb') as file:
+        content = file.read()
+    img = cv2.imread(IMAGE)
+    assert (RecognizerService.decode(content) == img).all()
+    assert (RecognizerService.decode(io.BytesIO(content)) == img).all()
+    assert RecognizerService.decode(img) is img
+
+
+def test_decode_invalid():
+    with pytest.raises(ImageDecodeError):
+        RecognizerService.decode(b'')
+    with pytest.raises(ImageDecodeError):
+        RecognizerService.decode(b'not an image')
+    with pytest.raises(ImageDecodeError):
+        RecognizerService.decode('app/tests/img/small.png')
+
+
+def test_service(recognizer):
+    assert isinstance(recognizer.service('cni'), CNIService)
+    with pytest.raises(KeyError):
+        recognizer.service('DoesNotAndWillNotExist')
+
+
+def test_recognize_progress(recognizer):
+    recognizer.ocv.read_regions = read_run
+    events = []
+    result, read = recognizer.recognize(cv2.imread(IMAGE), 'cni', progress=lambda *event: events.append(event))
+    assert result == RUN_DICT
+    assert read == RUN_TEXT
+    assert events[0] == ('read', {'source': 'ocr'})
+    assert ('field', {'field': 'run', 'value': events[1][1]['value'], 'valid': True}) in events
+
+
+def test_process_concurrent(recognizer):
+    # a single recognizer is shared by the threads
+    recognizer.ocv.read_regions = read_run
+    with open(IMAGE, 'rb') as file:
+        content = file.read()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: recognizer.process(content, 'cni'), range(8)))
+    assert results == [RUN_DICT] * 8
+
+
+def test_process_run(recognizer):
+    with open('app/tests/img/run.jpeg', 'rb') as file:
+        assert recognizer.process(file, 'cni') == RUN_DICT
+
+
+def test_recognize_crop():
+    recognizer = RecognizerService({'cni': CNIService()}, crop=CropService())
+    shapes = []
+
+    def read_regions(img, **_):
+        shapes.append(img.shape)
+        return RUN_TEXT, None
+    recognizer.ocv.read_regions = read_regions
+
+    # a card on a table, only the card is read
+    photo = np.full((900, 1200, 3), 60, dtype=np.uint8)
+    cv2.fillConvexPoly(photo, np.array([[300, 200], [900, 260], [860, 640], [260, 600]]), (235, 235, 235))
+    assert recognizer.process(photo, 'cni') == RUN_DICT
+    assert shapes[0][0] * shapes[0][1] < 900 * 1200 / 2
+
+    # no document to crop, the whole photo is read
+    assert recognizer.process(cv2.imread(IMAGE), 'cni') == RUN_DICT
+    assert shapes[1] == cv2.imread(IMAGE).shape
@@ -0,0 +1,57 @@
+import time
+import pytest
+from app.services.scheduler.deadline_service import DeadlineService, DeadlineExceededError
+
+
+def test_no_deadline():
+    deadline = DeadlineService()
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    deadline.check()
+
+
+def test_deadline():
+    deadline = DeadlineService(timeout=0.05)
+    assert 0 < deadline.remaining() <= 0.05
+    deadline.check()
+
+    time.sleep(0.06)
+    assert deadline.remaining() == 0
+    assert deadline.expired()
+    with pytest.raises(DeadlineExceededError):
+        deadline.check()
+
+
+def test_cancelled():
+    disconnected = []
+    deadline = DeadlineService(timeout=60, cancelled=lambda: bool(disconnected))
+    deadline.check()
+
+    disconnected.append(True)
+    with pytest.raises(DeadlineExceededError):
+        deadline.check()
+
+
+def test_tesseract():
+    def image_to_string(image, timeout=0, config=''):
+        if timeout and timeout < 1:
+            raise RuntimeError('Tesseract process timeout')
+        return f'{image} {timeout} {config}'
+
+    # the remaining time is passed as the timeout of the call, 0 (none) without deadline
+    assert DeadlineService().tesseract(image_to_string, 'image', config='psm') == 'image 0 psm'
+    assert DeadlineService(timeout=60).tesseract(image_to_string, 'image') != 'image 0 '
+
+    with pytest.raises(DeadlineExceededError):
+        DeadlineService(timeout=0.5).tesseract(image_to_string, 'image')
+    with pytest.raises(DeadlineExceededError):
+        DeadlineService(cancelled=lambda: True).tesseract(image_to_string, 'image')
+
+
+def test_tesseract_errors():
+    def image_to_string(image, timeout=0):
+        raise RuntimeError('Tesseract failed')
+
+    # other errors are not deadline errors
+    with pytest.raises(RuntimeError):
+        DeadlineService(timeout=60).tesseract(image_to_string, 'image')
@@ -0,0 +1,122 @@
+import time
+import pytest
+from threading import Thread
+from app.services.scheduler.scheduler_service import SchedulerService, QuotaExceededError
+from app.services.scheduler.deadline_service import DeadlineService, DeadlineExceededError
+
+
+def run_queued(scheduler, requests):
+    # the slot is held while the requests are queued one by one, so the order they run in
+    # only depends on the scheduler
+    order = []
+
+    def call(service_name, interactive, name):
+        with scheduler.slot(service_name, interactive=interactive):
+            order.append(name)
+
+    held = scheduler.slot('held')
+    held.__enter__()
+    threads = []
+    for service_name, interactive, name in requests:
+        threads.append(Thread(target=call, args=(service_name, interactive, name)))
+        threads[-1].start()
+        while scheduler.stats()['queued'] < len(threads):
+            time.sleep(0.001)
+    held.__exit__(None, None, None)
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_weighted_fair():
+    scheduler = SchedulerService(slots=1, weights={'cni': 2})
+    requests = [('basic', True, f'basic{i}') for i in range(4)] + [('cni', True, f'cni{i}') for i in range(4)]
+    order = run_queued(scheduler, requests)
+    # cni requests are not queued behind all the basic ones, they get twice their share
+    assert order == ['basic0', 'cni0', 'cni1', 'basic1', 'cni2', 'cni3', 'basic2', 'basic3']
+
+
+def test_interactive_before_batch():
+    scheduler = SchedulerService(slots=1)
+    requests = [('basic', False, 'batch0'), ('basic', False, 'batch1'), ('cni', True, 'interactive')]
+    assert run_queued(scheduler, requests) == ['interactive', 'batch0', 'batch1']
+
+
+def test_slots():
+    scheduler = SchedulerService(slots=2)
+    with scheduler.slot('cni'):
+        with scheduler.slot('basic'):
+            assert scheduler.stats()['running'] == 2
+    assert scheduler.stats()['running'] == 0
+
+
+def test_deadline():
+    scheduler = SchedulerService(slots=1)
+    with scheduler.slot('basic'):
+        # the request leaves the queue once its deadline passes
+        with pytest.raises(DeadlineExceededError):
+            with scheduler.slot('cni', deadline=DeadlineService(timeout=0.05)):
+                pass
+        assert scheduler.stats()['queued'] == 0
+    # and its slot is not granted to it
+    with scheduler.slot('cni'):
+        assert scheduler.stats()['running'] == 1
+    assert scheduler.stats()['running'] == 0
+
+
+def test_cancelled():
+    scheduler = SchedulerService(slots=1)
+    disconnected = []
+    with scheduler.slot('basic'):
+        # a queued request without timeout leaves the queue as soon as its client disconnects
+        Thread(target=lambda: (time.sleep(0.05), disconnected.append(True))).start()
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceededError):
+            with scheduler.slot('cni', deadline=DeadlineService(cancelled=lambda: bool(disconnected))):
+                pass
+        assert time.monotonic() - start < 0.4
+        assert scheduler.stats()['queued'] == 0
+
+
+def test_quota():
+    scheduler = SchedulerService(quota=1, quotas={'key': 2})
+    with scheduler.admit('client'):
+        with pytest.raises(QuotaExceededError):
+            with scheduler.admit('client'):
+                pass
+        # other clients are not affected
+        with scheduler.admit('other'):
+            pass
+    # the quota is released when the request ends
+    with scheduler.admit('client'):
+        pass
+
+    with scheduler.admit('key'):
+        with scheduler.admit('key'):
+            with pytest.raises(QuotaExceededError):
+                with scheduler.admit('key'):
+                    pass
+
+
+def test_stats():
+    scheduler = SchedulerService()
+    assert scheduler.stats() == {'running': 0, 'queued': 0, 'timeouts': {}, 'waits': {}}
+    for _ in range(3):
+        with scheduler.slot('cni'):
+            pass
+    waits = scheduler.stats()['waits']['cni']
+    assert waits['count'] == 3
+    assert 0 <= waits['p50'] <= waits['p99'] <= waits['max']
+
+
+def test_record_timeout():
+    scheduler = SchedulerService()
+    scheduler.record_timeout('cni')
+    scheduler.record_timeout('cni')
+    assert scheduler.stats()['timeouts'] == {'cni': 2}
+
+
+@pytest.mark.parametrize('weight', [0, -1, float('inf'), float('nan')])
+def test_invalid_weight(weight):
+    with pytest.raises(ValueError):
+        SchedulerService(weights={'cni': 4, 'basic': weight})
@@ -1,4 +1,6 @@
 from setuptools import setup
 
 # setup routes
-setup(name='app', packages=['app'])
\ No newline at end of file
+setup(name='app', packages=['app'],
+      # optional features: PDF documents and encrypted captures of slow requests
+      extras_require={'pdf': ['pymupdf'], 'capture': ['cryptography']})
\ No newline at end of file